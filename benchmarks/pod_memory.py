@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+peak RSS of a long pod watch.
+
+a synthetic watch stream of 10k events over 2000 pods is replayed, every
+event is decoded from json like the ones of the console. `raw` keeps the
+pod json of every pod in a dict, as `watch_app_pods --forever` used to,
+`records` feeds the events to PodTable, which keeps a PodRecord per pod.
+every mode runs in its own process, the growth of ru_maxrss is reported.
+
+    python benchmarks/pod_memory.py [--events 10000] [--pods 2000]
+"""
+from __future__ import print_function, division, absolute_import
+import os
+import sys
+import json
+import random
+import argparse
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kae.pods import PodTable  # noqa: E402
+
+PHASES = ('Pending', 'Running', 'Running', 'Running', 'Succeeded')
+
+
+def pod_json(i, seq):
+    name = 'app-{}-{:05d}'.format('7d9f8b6c5d', i)
+    containers = [{
+        'name': 'app' if c == 0 else 'sidecar-{}'.format(c),
+        'image': 'registry.example.com/team/app:v{}'.format(seq % 9),
+        'command': ['/bin/sh', '-c', 'exec gunicorn -w 4 -b 0.0.0.0:8080 app:app'],
+        'env': [{'name': 'ENV_{}'.format(k), 'value': 'value-{}-{}'.format(k, i)} for k in range(20)],
+        'resources': {'limits': {'cpu': '1', 'memory': '1Gi'}, 'requests': {'cpu': '500m', 'memory': '512Mi'}},
+        'volume_mounts': [{'name': 'config', 'mount_path': '/etc/app'}, {'name': 'token', 'mount_path': '/var/run'}],
+    } for c in range(2)]
+    return json.dumps({
+        'action': 'MODIFIED',
+        'object': {
+            'metadata': {
+                'name': name, 'namespace': 'default', 'uid': '{:032x}'.format(i),
+                'resource_version': str(seq), 'labels': {'app': 'app', 'release': 'v{}'.format(seq % 9)},
+                'annotations': {'kubectl.kubernetes.io/restartedAt': '2019-01-01T00:00:00Z'},
+                'owner_references': [{'kind': 'ReplicaSet', 'name': 'app-7d9f8b6c5d', 'uid': '{:032x}'.format(7)}],
+            },
+            'spec': {'containers': containers, 'node_name': 'node-{}'.format(i % 50),
+                     'volumes': [{'name': 'config', 'config_map': {'name': 'app'}}]},
+            'status': {
+                'phase': PHASES[seq % len(PHASES)],
+                'pod_ip': '10.0.{}.{}'.format(i // 250, i % 250), 'host_ip': '192.168.0.{}'.format(i % 50),
+                'conditions': [{'type': t, 'status': 'True', 'last_transition_time': '2019-01-01T00:00:00Z'}
+                               for t in ('Initialized', 'Ready', 'ContainersReady', 'PodScheduled')],
+                'container_statuses': [{
+                    'name': c['name'], 'ready': seq % 3 != 0, 'restart_count': seq % 4,
+                    'image': c['image'], 'image_id': 'docker-pullable://' + c['image'],
+                    'container_id': 'docker://{:064x}'.format(seq),
+                    'state': {'running': {'started_at': '2019-01-01T00:00:00Z'}},
+                } for c in containers],
+            },
+        },
+    })
+
+
+def events(count, pods):
+    rnd = random.Random(42)
+    for seq in range(count):
+        yield json.loads(pod_json(rnd.randrange(pods), seq))
+
+
+def replay(mode, count, pods):
+    start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if mode == 'raw':
+        pod_map = {}
+        for m in events(count, pods):
+            pod_map[m['object']['metadata']['name']] = m['object']
+    else:
+        table = PodTable({'default': pods})
+        for m in events(count, pods):
+            table.apply('default', m)
+    # kB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--events', type=int, default=10000)
+    parser.add_argument('--pods', type=int, default=2000)
+    parser.add_argument('--mode', choices=('raw', 'records'), help=argparse.SUPPRESS)
+    opts = parser.parse_args()
+
+    if opts.mode:
+        print(replay(opts.mode, opts.events, opts.pods))
+        return
+    print('{} events over {} pods, peak RSS growth'.format(opts.events, opts.pods))
+    for mode in ('raw', 'records'):
+        out = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--mode', mode,
+                                       '--events', str(opts.events), '--pods', str(opts.pods)])
+        print('{:<10} {:8.1f}MB'.format(mode, int(out) / 1024.0))
+
+
+if __name__ == '__main__':
+    main()
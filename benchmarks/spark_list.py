@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+spark:list over a synthetic list of scheduled spark apps.
+
+the console is replaced by a stub returning N apps, every run goes through
+the real command with a fresh cache dir. `baseline` is what spark:list did
+before: yaml.safe_load of every spec and a buffered PrettyTable.
+
+    python benchmarks/spark_list.py [--apps 5000] [--runs 3]
+"""
+from __future__ import print_function, division, absolute_import
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+
+import click
+import yaml
+from click.testing import CliRunner
+from prettytable import PrettyTable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kae.spark import SPARKAPP_COLUMNS, list_sparkapp  # noqa: E402
+
+SPEC = """appname: app-{i}
+apptype: scheduledsparkapplication
+schedule: "{m} * * * *"
+concurrencyPolicy: Forbid
+image: registry.example.com/spark/app-{i}:v{v}
+mainfile: s3a://bucket/app-{i}/main.py
+pythonVersion: "3"
+sparkVersion: 2.4.0
+arguments: [--date, "{{{{ds}}}}", --partitions, "{p}"]
+sparkConf:
+  spark.sql.shuffle.partitions: "{p}"
+  spark.dynamicAllocation.enabled: "false"
+driver:
+  cpu: 1
+  memory: 2g
+executor:
+  cpu: {c}
+  memory: {mem}g
+  instances: {n}
+deps:
+  pyFiles: [s3a://bucket/app-{i}/deps.zip]
+  jars: [s3a://bucket/jars/hadoop-aws.jar, s3a://bucket/jars/aws-sdk.jar]
+comment: synthetic app {i}
+"""
+
+
+def sparkapps(count):
+    return [{
+        'name': 'app-{}'.format(i),
+        'status': ('RUNNING', 'COMPLETED', 'FAILED', 'SUBMITTED')[i % 4],
+        'nickname': 'user{}'.format(i % 20),
+        'created': '2019-01-01 00:00:00',
+        'specs_text': SPEC.format(i=i, m=i % 60, v=i % 7, p=100 + i % 50, c=1 + i % 4, mem=2 + i % 8, n=2 + i % 10),
+    } for i in range(count)]
+
+
+class StubKaeAPI(object):
+    def __init__(self, apps):
+        self.apps = apps
+
+    def list_sparkapp(self):
+        return self.apps
+
+
+def baseline(apps):
+    """spark:list before the spec cache"""
+    table = PrettyTable(SPARKAPP_COLUMNS)
+    for r in apps:
+        specs = yaml.safe_load(r['specs_text'])
+        table.add_row([r['name'], specs['apptype'], specs['driver']['cpu'], specs['driver']['memory'],
+                       specs['executor']['cpu'], specs['executor']['memory'], specs['executor']['instances'],
+                       r['status'], r['nickname'], r['created'],
+                       specs.get('schedule', None), specs.get('concurrencyPolicy', None)])
+    return str(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--apps', type=int, default=5000)
+    parser.add_argument('--runs', type=int, default=3)
+    opts = parser.parse_args()
+
+    apps = sparkapps(opts.apps)
+    command = click.command()(list_sparkapp)
+    runner = CliRunner()
+    cache_dir = tempfile.mkdtemp(prefix='kae-bench-')
+    os.environ['KAE_CACHE_DIR'] = cache_dir
+
+    def run(args, cold):
+        if cold:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        start = time.time()
+        result = runner.invoke(command, args, obj={'kae_api': StubKaeAPI(apps)})
+        if result.exit_code != 0:
+            raise RuntimeError(result.output or repr(result.exception))
+        return time.time() - start
+
+    cases = [
+        ('baseline', None, None),
+        ('table, cold cache', [], True),
+        ('table, warm cache', [], False),
+        ('--stream, warm cache', ['--stream'], False),
+        ('--status FAILED, cold cache', ['--status', 'FAILED'], True),
+        ('--limit 50, cold cache', ['--limit', '50'], True),
+    ]
+    print('spark:list of {} apps, median of {} runs'.format(opts.apps, opts.runs))
+    try:
+        for name, args, cold in cases:
+            times = []
+            for _ in range(opts.runs):
+                if args is None:
+                    start = time.time()
+                    baseline(apps)
+                    times.append(time.time() - start)
+                else:
+                    times.append(run(args, cold))
+            print('{:<30} {:8.0f}ms'.format(name, statistics.median(times) * 1000))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+cold start budget of kae.
+
+every command runs `python -X importtime` a few times, the median total
+import time is checked against its budget and the heavy modules must not
+be imported at all. exit with 1 if a command is over.
+
+    python benchmarks/startup.py [--runs 7] [--scale 1.0]
+
+--scale multiplies the budgets, for slow CI machines.
+"""
+from __future__ import print_function, division, absolute_import
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+# (command, import time budget in ms)
+BUDGETS = (
+    (['version'], 200),
+    (['build', '--help'], 200),
+    (['app:get', '--help'], 250),
+)
+# none of them needs these
+HEAVY_MODULES = ('keycloak', 'kaelib', 'reprint', 'tqdm', 'jinja2', 'pkg_resources', 'delegator', 'requests')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_RUN_KAE = 'import sys; from kae.cli import main; sys.argv = ["kae"] + sys.argv[1:]; main()'
+
+
+def import_times(args):
+    """{top level module: cumulative import time in us} of one cold run"""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1', KAE_CONFIG_PATH=os.devnull)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', _RUN_KAE] + args, cwd=ROOT, env=env,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # nested imports are indented, their time is in the parent's already
+        if not name.startswith('  '):
+            times[name.strip()] = int(cumulative)
+        else:
+            times.setdefault(name.strip(), 0)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--scale', type=float, default=1.0)
+    opts = parser.parse_args()
+
+    failed = False
+    for args, budget in BUDGETS:
+        budget *= opts.scale
+        totals = []
+        heavy = set()
+        for _ in range(opts.runs):
+            times = import_times(args)
+            totals.append(sum(v for k, v in times.items()) / 1000.0)
+            heavy.update(m for m in times if m.split('.')[0] in HEAVY_MODULES)
+        median = statistics.median(totals)
+        ok = median <= budget and not heavy
+        failed = failed or not ok
+        print('{:<20} {:7.1f}ms / {:.0f}ms {}{}'.format(
+            'kae ' + ' '.join(args), median, budget, 'ok' if ok else 'OVER',
+            ', imports ' + ', '.join(sorted(heavy)) if heavy else ''))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,15 +5,18 @@
 
 """
 from __future__ import print_function, division, absolute_import
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import click
-from tqdm import tqdm
-from reprint import output
-from prettytable import PrettyTable
 from .utils import (
     error, info, get_git_tag, get_remote_url, get_specs_text,
     get_appname, get_current_branch, fatal, handle_console_err,
-    merge_list, display_pods,
+    get_clusters, clone_kae_api,
 )
+from .pods import PodWatcher, RolloutReport, display_pods, display_multi_cluster_pods, wait_pods
+from .batch import batch_options, read_appnames, run_batch
 
 def cfg_list_to_dict(lst):
     _dict = {}
@@ -38,6 +41,93 @@ def cfg_list_to_dict(lst):
     return _dict
 
 
+def new_rollout_report(appname, watch, report, report_json):
+    """RolloutReport for --report/--report-json, None if neither is given"""
+    if not (report or report_json):
+        return None
+    if not watch:
+        fatal("--report and --report-json need --watch or --wait-timeout")
+    return RolloutReport(appname)
+
+
+def show_rollout_report(rollout, report_json):
+    if rollout is None:
+        return
+    rollout.show()
+    if report_json:
+        rollout.write_json(report_json)
+        click.echo(info('rollout report written to {}'.format(report_json)))
+
+
+def watch_rollout(kae, appname, watch, wait_timeout, canary=False, rollout=None, report_json=None):
+    """--watch and --wait-timeout on a single cluster, exit with the code
+    of wait_pods when the pods don't get ready"""
+    code = 0
+    with handle_console_err():
+        if wait_timeout is not None:
+            code, _ = wait_pods({kae.cluster: (kae, PodWatcher(kae, appname, canary=canary))}, appname,
+                                canary=canary, timeout=wait_timeout, watch=watch, report=rollout)
+        elif watch:
+            display_pods(kae, PodWatcher(kae, appname, canary=canary), appname, canary=canary, report=rollout)
+    show_rollout_report(rollout, report_json)
+    if code:
+        sys.exit(code)
+
+
+def run_on_clusters(kae, clusters, appname, action, watch, canary=False, rollout=None, report_json=None,
+                    wait_timeout=None):
+    """run action(kae) on every cluster concurrently, each cluster has its own
+    KaeAPI, then optionally watch or wait for pods of all clusters together.
+    print a per cluster summary and exit with 1 if any cluster failed, or with
+    the code of wait_pods if pods didn't get ready."""
+    from kaelib import KaeAPIError
+    from prettytable import PrettyTable
+
+    apis = {cluster: clone_kae_api(kae, cluster) for cluster in clusters}
+
+    def run(cluster):
+        start = time.time()
+        try:
+            action(apis[cluster])
+            return cluster, None, time.time() - start
+        except KaeAPIError as e:
+            return cluster, e.msg, time.time() - start
+        except Exception as e:
+            # e.g. a connection error, the other clusters go on
+            return cluster, '{}: {}'.format(type(e).__name__, str(e)), time.time() - start
+
+    with ThreadPoolExecutor(max_workers=len(clusters)) as executor:
+        results = {cluster: (err, elapsed) for cluster, err, elapsed in executor.map(run, clusters)}
+
+    ready_at = {}
+    code = 0
+    succeeded = [c for c in clusters if results[c][0] is None]
+    if succeeded and (watch or wait_timeout is not None):
+        targets = {c: (apis[c], PodWatcher(apis[c], appname, canary=canary)) for c in succeeded}
+        if wait_timeout is not None:
+            code, ready_at = wait_pods(targets, appname, canary=canary, timeout=wait_timeout,
+                                       watch=watch, report=rollout)
+        else:
+            ready_at = display_multi_cluster_pods(targets, appname, canary=canary, report=rollout)
+
+    table = PrettyTable(['cluster', 'exit code', 'result', 'request', 'ready'])
+    table.align['result'] = 'l'
+    for cluster in clusters:
+        err, elapsed = results[cluster]
+        ready = ready_at.get(cluster)
+        table.add_row([
+            cluster, 1 if err else 0, err or 'ok', '{:.1f}s'.format(elapsed),
+            '-' if ready is None else '{:.1f}s'.format(ready),
+        ])
+    click.echo(table)
+    show_rollout_report(rollout, report_json)
+    if len(succeeded) != len(clusters):
+        click.echo(error('failed on {} of {} clusters'.format(len(clusters) - len(succeeded), len(clusters))))
+        sys.exit(1)
+    if code:
+        sys.exit(code)
+
+
 @click.argument('appname', required=False)
 @click.argument('tag', required=False)
 @click.option('--block', default=False, is_flag=True, help='block when exist other build task for this app')
@@ -93,28 +183,41 @@ def build_app(ctx, appname, tag, block):
 @click.option('--memories', multiple=True, help='how much memory to set, format `idx,req,limit` or `req,limit` e.g. --memory 0,64M,256M')
 @click.option('--replicas', type=int, help='repliocas of app, e.g. --replicas 2')
 @click.option('--yaml-name', default='default', help="app yaml name")
-@click.option('--cluster', default='default', help='cluster name')
+@click.option('--cluster', default='default', help='cluster name, use `a,b,c` to deploy to several clusters in parallel')
+@click.option('--all-clusters', default=False, is_flag=True, help='deploy to all clusters listed in config')
 @click.option('--use-newest-config', default=False, is_flag=True, help='use newest config')
 @click.option('--watch', default=False, is_flag=True, help='watch pods')
+@click.option('--wait-timeout', type=int,
+              help='wait until all pods are ready, exit with 3 if a pod is crashing or 124 after this many seconds, 0 waits forever')
+@click.option('--report', default=False, is_flag=True, help='with --watch, print pod startup latency when all pods are ready')
+@click.option('--report-json', type=click.Path(dir_okay=False), help='with --watch, also write the latency report to this json file')
 @click.pass_context
-def deploy_app(ctx, appname, cluster, tag, cpus, memories,
-               replicas, yaml_name, use_newest_config, watch):
+def deploy_app(ctx, appname, cluster, all_clusters, tag, cpus, memories,
+               replicas, yaml_name, use_newest_config, watch, wait_timeout, report, report_json):
     tag = get_git_tag(git_tag=tag)
     appname = get_appname(appname=appname)
+    rollout = new_rollout_report(appname, watch or wait_timeout is not None, report, report_json)
 
     cpus_dict = cfg_list_to_dict(cpus)
     memories_dict = cfg_list_to_dict(memories)
 
     kae = ctx.obj['kae_api']
-    kae.set_cluster(cluster)
+    clusters = get_clusters(ctx, cluster, all_clusters)
+    if len(clusters) > 1:
+        run_on_clusters(kae, clusters, appname, lambda api: api.deploy_app(
+            appname, tag, cpus_dict, memories_dict, replicas, app_yaml_name=yaml_name,
+            use_newest_config=use_newest_config), watch,
+            rollout=rollout, report_json=report_json, wait_timeout=wait_timeout)
+        click.echo(info("deploy done.."))
+        return
+
+    kae.set_cluster(clusters[0])
 
     with handle_console_err():
         kae.deploy_app(appname, tag, cpus_dict, memories_dict,
                        replicas, app_yaml_name=yaml_name,
                        use_newest_config=use_newest_config)
-    if watch:
-        watcher = kae.get_app_pods(appname, watch=True)
-        display_pods(kae, watcher, appname)
+    watch_rollout(kae, appname, watch, wait_timeout, rollout=rollout, report_json=report_json)
     click.echo(info("deploy done.."))
 
 
@@ -126,10 +229,16 @@ def deploy_app(ctx, appname, cluster, tag, cpus, memories,
 @click.option('--yaml-name', default='default', help="app yaml name")
 @click.option('--cluster', default='default', help='cluster name')
 @click.option('--watch', default=False, is_flag=True, help='watch pods')
+@click.option('--wait-timeout', type=int,
+              help='wait until all pods are ready, exit with 3 if a pod is crashing or 124 after this many seconds, 0 waits forever')
+@click.option('--report', default=False, is_flag=True, help='with --watch, print pod startup latency when all pods are ready')
+@click.option('--report-json', type=click.Path(dir_okay=False), help='with --watch, also write the latency report to this json file')
 @click.pass_context
-def deploy_app_canary(ctx, appname, cluster, tag, cpus, memories, replicas, yaml_name, watch):
+def deploy_app_canary(ctx, appname, cluster, tag, cpus, memories, replicas, yaml_name,
+                      watch, wait_timeout, report, report_json):
     tag = get_git_tag(git_tag=tag)
     appname = get_appname(appname=appname)
+    rollout = new_rollout_report(appname, watch or wait_timeout is not None, report, report_json)
 
     cpus_dict = cfg_list_to_dict(cpus)
     memories_dict = cfg_list_to_dict(memories)
@@ -140,30 +249,47 @@ def deploy_app_canary(ctx, appname, cluster, tag, cpus, memories, replicas, yaml
     with handle_console_err():
         kae.deploy_app_canary(appname, tag, cpus_dict, memories_dict,
                               replicas, app_yaml_name=yaml_name)
-    if watch:
-        watcher = kae.get_app_pods(appname, canary=True, watch=True)
-        display_pods(kae, watcher, appname, canary=True)
+    watch_rollout(kae, appname, watch, wait_timeout, canary=True, rollout=rollout, report_json=report_json)
     click.echo(info("deploy done.."))
 
 
 @click.argument('appname', required=False)
 @click.option('--replicas', default=0, type=int, help='repliocas of app, e.g. --replicas 2')
-@click.option('--cluster', default='default', help='cluster name')
+@click.option('--cluster', default='default', help='cluster name, use `a,b,c` to scale on several clusters in parallel')
+@click.option('--all-clusters', default=False, is_flag=True, help='scale on all clusters listed in config')
 @click.option('--watch', default=False, is_flag=True, help='watch pods')
+@click.option('--wait-timeout', type=int,
+              help='wait until all pods are ready, exit with 3 if a pod is crashing or 124 after this many seconds, 0 waits forever')
+@click.option('--report', default=False, is_flag=True, help='with --watch, print pod startup latency when all pods are ready')
+@click.option('--report-json', type=click.Path(dir_okay=False), help='with --watch, also write the latency report to this json file')
+@batch_options
 @click.pass_context
-def scale_app(ctx, appname, replicas, cluster, watch):
-    appname = get_appname(appname=appname)
-
+def scale_app(ctx, appname, replicas, cluster, all_clusters, watch, wait_timeout, report, report_json,
+              apps, apps_file, concurrency, rate):
     if replicas <= 0:
         fatal("replicas should be a positive integer")
 
     kae = ctx.obj['kae_api']
+    clusters = get_clusters(ctx, cluster, all_clusters)
+    appnames = read_appnames(apps, apps_file, appname)
+    if appnames:
+        if len(clusters) > 1 or watch or wait_timeout is not None or report or report_json:
+            fatal("batch mode doesn't support multiple clusters, --watch, --wait-timeout, --report or --report-json")
+        kae.set_cluster(clusters[0])
+        run_batch(kae, appnames, lambda api, name: api.scale_app(name, replicas), concurrency, rate)
+        return
 
-    kae.set_cluster(cluster)
+    appname = get_appname(appname=appname)
+    rollout = new_rollout_report(appname, watch or wait_timeout is not None, report, report_json)
+    if len(clusters) > 1:
+        run_on_clusters(kae, clusters, appname, lambda api: api.scale_app(appname, replicas), watch,
+                        rollout=rollout, report_json=report_json, wait_timeout=wait_timeout)
+        click.echo(info("scale done.."))
+        return
+
+    kae.set_cluster(clusters[0])
     with handle_console_err():
         kae.scale_app(appname, replicas)
 
-    if watch:
-        watcher = kae.get_app_pods(appname, watch=True)
-        display_pods(kae, watcher, appname)
+    watch_rollout(kae, appname, watch, wait_timeout, rollout=rollout, report_json=report_json)
     click.echo(info("scale done.."))
@@ -5,6 +5,7 @@
 
 """
 from __future__ import print_function, division, absolute_import
+import sys
 import pprint
 import json
 import click
@@ -12,25 +13,41 @@ from prettytable import PrettyTable
 from kae.utils import (
     get_appname, get_current_branch, get_remote_url, get_git_tag,
     get_specs_text, error, info, fatal, handle_console_err,
-    display_pods,
+    get_clusters, clone_kae_api,
 )
+from kae.pods import PodWatcher, PodRecord, display_pods, wait_pods
+from kae.output import output_option, get_output_format, echo_data, wide_columns
+from kae.batch import batch_options, read_appnames, run_batch
 
 
 @click.argument('appname', required=False)
-@click.option('--raw', default=False, is_flag=True, help='print the raw json')
+@output_option
+@batch_options
 @click.pass_context
-def get_app(ctx, appname, raw):
+def get_app(ctx, appname, output, raw, apps, apps_file, concurrency, rate):
     kae = ctx.obj['kae_api']
+    fmt = get_output_format(output, raw)
+    appnames = read_appnames(apps, apps_file, appname)
+    if appnames:
+        def action(api, name):
+            app = api.get_app(name)
+            if fmt in ('table', 'wide'):
+                return '{} {} {}'.format(app['type'], app['git'], app['created'])
+            return app
+        run_batch(kae, appnames, action, concurrency, rate, fmt=fmt)
+        return
+
     appname = get_appname(appname=appname)
     with handle_console_err():
         app = kae.get_app(appname)
-    if raw:
-        click.echo(str(app))
-    else:
-        table = PrettyTable(['name', 'type', 'git', 'created'])
-        table.align['git'] = 'l'
-        table.add_row([app['name'], app['type'], app['git'], app['created']])
-        click.echo(table)
+
+    def table(columns=('name', 'type', 'git', 'created')):
+        t = PrettyTable(columns)
+        t.align['git'] = 'l'
+        t.add_row([app.get(c) for c in columns])
+        return t
+
+    echo_data(app, fmt, table, lambda: table(wide_columns(['name', 'type', 'git', 'created'], [app])))
 
 
 @click.argument('appname', required=False)
@@ -72,29 +89,35 @@ def set_app_abtesting_rules(ctx, appname, rules, cluster):
     click.echo(info(json.dumps(ret)))
 
 
+def _release_table(appname, releases, wide=False):
+    columns = ['name', 'tag', 'created']
+    if wide:
+        columns = wide_columns(columns, releases, skip=('specs_text', ))
+    table = PrettyTable(columns)
+    for r in releases:
+        table.add_row([appname] + [r.get(c) for c in columns[1:]])
+    return table
+
+
 @click.argument('appname', required=False)
-@click.option('--raw', default=False, is_flag=True, help='print the raw json')
+@output_option
 @click.pass_context
-def get_app_releases(ctx, appname, raw):
+def get_app_releases(ctx, appname, output, raw):
     kae = ctx.obj['kae_api']
     appname = get_appname(appname=appname)
     with handle_console_err():
         releases = kae.get_app_releases(appname)
 
-    if raw:
-        click.echo(str(releases))
-    else:
-        table = PrettyTable(['name', 'tag', 'created'])
-        for r in releases:
-            table.add_row([appname, r['tag'], r['created']])
-        click.echo(table)
+    echo_data(releases, get_output_format(output, raw),
+              lambda: _release_table(appname, releases),
+              lambda: _release_table(appname, releases, wide=True))
 
 
 @click.argument('appname', required=False)
-@click.option('--raw', default=False, is_flag=True, help='print the raw json')
+@output_option
 @click.option('--cluster', default='default', help='cluster name')
 @click.pass_context
-def get_app_pods(ctx, appname, cluster, raw):
+def get_app_pods(ctx, appname, cluster, output, raw):
     kae = ctx.obj['kae_api']
     appname = get_appname(appname=appname)
     kae.set_cluster(cluster)
@@ -102,16 +125,24 @@ def get_app_pods(ctx, appname, cluster, raw):
     with handle_console_err():
         pods = kae.get_app_pods(appname)
 
-    if raw:
-        click.echo(str(pods))
-    else:
-        table = PrettyTable(['name', 'status', 'ready'])
+    def table():
+        t = PrettyTable(['name', 'status', 'ready'])
         for item in pods['items']:
             name = item['metadata']['name']
             status = item['status']['phase']
             ready = sum([1 if c_status['ready'] else 0 for c_status in item['status']['container_statuses']])
-            table.add_row([name, status, ready])
-        click.echo(table)
+            t.add_row([name, status, ready])
+        return t
+
+    def wide():
+        t = PrettyTable(['name', 'status', 'ready', 'restarts', 'ip', 'node'])
+        for item in pods['items']:
+            record = PodRecord(item['metadata']['name'])
+            record.update(item)
+            t.add_row([record.name, record.status, record.ready, record.restarts, record.ip, record.node])
+        return t
+
+    echo_data(pods, get_output_format(output, raw), table, wide, items=pods['items'])
 
 
 @click.argument('appname', required=False)
@@ -123,9 +154,8 @@ def watch_app_pods(ctx, appname, cluster, raw):
     appname = get_appname(appname=appname)
     kae.set_cluster(cluster)
 
-    # with handle_console_err():
-    watcher = kae.watch_app_pods(appname)
-    display_pods(kae, watcher, appname, forever=True)
+    with handle_console_err():
+        display_pods(kae, PodWatcher(kae, appname), appname, forever=True)
 
     # if raw:
     #     click.echo(str(pods))
@@ -138,11 +168,33 @@ def watch_app_pods(ctx, appname, cluster, raw):
     #         table.add_row([name, status, ready])
     #     click.echo(table)
 
+@click.argument('appname', required=False)
+@click.option('--cluster', default='default', help='cluster name, use `a,b,c` to wait on several clusters')
+@click.option('--canary', default=False, is_flag=True, help='wait for the canary pods')
+@click.option('--timeout', default=600, type=int, help='seconds to wait, 0 waits forever')
+@click.pass_context
+def wait_app(ctx, appname, cluster, canary, timeout):
+    """wait until all pods are ready, exit with 3 if a pod is crashing
+    or can't pull its image, and with 124 on timeout"""
+    kae = ctx.obj['kae_api']
+    appname = get_appname(appname=appname)
+    clusters = get_clusters(ctx, cluster)
+    targets = {}
+    for c in clusters:
+        api = clone_kae_api(kae, c)
+        targets[c] = (api, PodWatcher(api, appname, canary=canary))
+
+    with handle_console_err():
+        code, _ = wait_pods(targets, appname, canary=canary, timeout=timeout)
+    if code:
+        sys.exit(code)
+
+
 @click.argument('appname', required=False)
 @click.argument('tag', required=False)
-@click.option('--raw', default=False, is_flag=True, help='print the raw json')
+@output_option
 @click.pass_context
-def get_release(ctx, appname, tag, raw):
+def get_release(ctx, appname, tag, output, raw):
     kae = ctx.obj['kae_api']
     appname = get_appname(appname=appname)
     tag = get_git_tag(git_tag=tag)
@@ -150,12 +202,9 @@ def get_release(ctx, appname, tag, raw):
     with handle_console_err():
         r = kae.get_release(appname, tag)
 
-    if raw:
-        click.echo(str(r))
-    else:
-        table = PrettyTable(['name', 'tag', 'created'])
-        table.add_row([appname, r['tag'], r['created']])
-        click.echo(table)
+    echo_data(r, get_output_format(output, raw),
+              lambda: _release_table(appname, [r]),
+              lambda: _release_table(appname, [r], wide=True))
 
 
 @click.argument('appname', required=False)
@@ -173,8 +222,9 @@ def get_release_specs(ctx, appname, tag):
 
 @click.argument('appname', required=False)
 @click.option('--cluster', default='default', help='cluster name')
+@output_option
 @click.pass_context
-def get_secret(ctx, appname, cluster):
+def get_secret(ctx, appname, cluster, output, raw):
     kae = ctx.obj['kae_api']
     appname = get_appname(appname=appname)
     kae.set_cluster(cluster)
@@ -182,8 +232,7 @@ def get_secret(ctx, appname, cluster):
     with handle_console_err():
         d = kae.get_secret(appname)
 
-    ss = pprint.pformat(d)
-    click.echo(info(ss))
+    echo_data(d, get_output_format(output, raw), lambda: info(pprint.pformat(d)))
 
 
 @click.argument('appname', required=False)
@@ -223,14 +272,20 @@ def set_secret(ctx, appname, cluster, f, literal, replace):
 
 @click.argument('appname', required=False)
 @click.option('--cluster', default='default', help='cluster name')
+@output_option
 @click.pass_context
-def get_config(ctx, appname, cluster):
+def get_config(ctx, appname, cluster, output, raw):
     kae = ctx.obj['kae_api']
     kae.set_cluster(cluster)
 
     appname = get_appname(appname=appname)
     with handle_console_err():
         d = kae.get_config(appname)
+    fmt = get_output_format(output, raw)
+    if fmt not in ('table', 'wide'):
+        echo_data(d, fmt)
+        return
+
     newest = d.get("newest")
     current = d.get("current")
 
@@ -317,23 +372,49 @@ def register_release(ctx, appname, tag, git, f, literal, force):
 @click.argument('appname', required=False)
 @click.option('--cluster', default='default', help='cluster name')
 @click.argument('revision', default=0)
+@click.option('--revision', 'revision_option', type=int, help='revision to roll back to, same as REVISION, needed in batch mode')
+@click.option('--wait-timeout', type=int,
+              help='wait until all pods are ready, exit with 3 if a pod is crashing or 124 after this many seconds, 0 waits forever')
+@batch_options
 @click.pass_context
-def rollback(ctx, appname, cluster, revision):
-    appname = get_appname(appname=appname)
+def rollback(ctx, appname, cluster, revision, revision_option, wait_timeout, apps, apps_file, concurrency, rate):
     kae = ctx.obj['kae_api']
     kae.set_cluster(cluster)
+    if revision_option is not None:
+        if revision:
+            fatal("REVISION argument can't be used with --revision")
+        revision = revision_option
+    appnames = read_appnames(apps, apps_file, appname)
+    if appnames:
+        if wait_timeout is not None:
+            fatal("batch mode doesn't support --wait-timeout")
+        run_batch(kae, appnames, lambda api, name: api.rollback(name, revision), concurrency, rate)
+        return
+
+    appname = get_appname(appname=appname)
     with handle_console_err():
         kae.rollback(appname, revision)
     click.echo(info('Rollback %s(revision %s) done.' % (appname, revision)))
+    if wait_timeout is not None:
+        with handle_console_err():
+            code, _ = wait_pods({cluster: (kae, PodWatcher(kae, appname))}, appname, timeout=wait_timeout)
+        if code:
+            sys.exit(code)
 
 
 @click.argument('appname', required=False)
 @click.option('--cluster', default='default', help='cluster name')
+@batch_options
 @click.pass_context
-def renew(ctx, appname, cluster):
-    appname = get_appname(appname=appname)
+def renew(ctx, appname, cluster, apps, apps_file, concurrency, rate):
     kae = ctx.obj['kae_api']
     kae.set_cluster(cluster)
+    appnames = read_appnames(apps, apps_file, appname)
+    if appnames:
+        run_batch(kae, appnames, lambda api, name: api.renew(name), concurrency, rate)
+        return
+
+    appname = get_appname(appname=appname)
     with handle_console_err():
         kae.renew(appname)
     click.echo(info('Renew %s done.' % (appname, )))
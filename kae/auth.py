@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+
+"""
+from __future__ import print_function, division, absolute_import
+import os
+import time
+import click
+from prettytable import PrettyTable
+
+from kae.utils import (
+    info, warn, fatal, read_yaml_file, get_token_cache_path, get_token_cache_key,
+    read_token_cache, write_token_cache, get_keycloak_client,
+)
+
+
+def _load_config(ctx):
+    config = read_yaml_file(ctx.obj['config_path'])
+    if not config:
+        fatal("config file {} not found".format(ctx.obj['config_path']))
+    return config
+
+
+def _current_cache_key(config):
+    return get_token_cache_key(
+        config['sso_username'],
+        config['sso_host'],
+        config.get('sso_realm', "kae"),
+        config.get('sso_client_id', "kae-cli"),
+    )
+
+
+def _format_expiry(expires_at, now):
+    if expires_at is None:
+        return 'never'
+    left = int(expires_at - now)
+    if left <= 0:
+        return 'expired'
+    return '{}s'.format(left)
+
+
+@click.pass_context
+def auth_status(ctx):
+    """show the cached sso token of current user"""
+    config = _load_config(ctx)
+    cache_path = get_token_cache_path(ctx.obj['config_path'])
+    entry = read_token_cache(cache_path).get(_current_cache_key(config))
+    if not entry:
+        click.echo(warn('no cached token for {}, next command will login with password'.format(config['sso_username'])))
+        return
+
+    now = time.time()
+    table = PrettyTable(['user', 'sso host', 'realm', 'client id', 'access token', 'refresh token'])
+    table.add_row([
+        config['sso_username'], config['sso_host'],
+        config.get('sso_realm', "kae"), config.get('sso_client_id', "kae-cli"),
+        _format_expiry(entry.get('expires_at'), now),
+        _format_expiry(entry.get('refresh_expires_at'), now) if entry.get('refresh_token') else 'none',
+    ])
+    click.echo(table)
+    click.echo(info('token cache: {}'.format(cache_path)))
+
+
+@click.option('--all', 'all_users', default=False, is_flag=True, help='remove the cached tokens of all users')
+@click.pass_context
+def auth_logout(ctx, all_users):
+    """revoke and remove the cached sso token"""
+    cache_path = get_token_cache_path(ctx.obj['config_path'])
+    cache = read_token_cache(cache_path)
+    if all_users:
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        click.echo(info('removed {} cached token(s).'.format(len(cache))))
+        return
+
+    from keycloak.exceptions import KeycloakError
+
+    config = _load_config(ctx)
+    entry = cache.pop(_current_cache_key(config), None)
+    if entry is None:
+        click.echo(warn('no cached token for {}'.format(config['sso_username'])))
+        return
+
+    if entry.get('refresh_token'):
+        keycloak_openid = get_keycloak_client(
+            config['sso_host'],
+            config.get('sso_realm', "kae"),
+            config.get('sso_client_id', "kae-cli"),
+        )
+        try:
+            keycloak_openid.logout(entry['refresh_token'])
+        except KeycloakError as e:
+            # the cached token is removed anyway
+            click.echo(warn('revoke sso session failed: {}'.format(str(e))))
+    write_token_cache(cache, cache_path)
+    click.echo(info('Logout {} done.'.format(config['sso_username'])))
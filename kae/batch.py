@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+run one command on many apps at once, e.g. renew 40 apps during an incident.
+"""
+from __future__ import print_function, division, absolute_import
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import click
+from prettytable import PrettyTable
+
+from kae.utils import error, info, fatal, format_console_err, clone_kae_api
+
+
+def batch_options(f):
+    """options shared by the commands which support batch mode"""
+    options = [
+        click.option('--apps', help='batch mode: comma separated app names'),
+        click.option('--apps-file', type=click.File('r'),
+                     help='batch mode: file with one app name per line, `-` for stdin'),
+        click.option('--concurrency', default=8, type=int, help='batch mode: max apps processed at the same time'),
+        click.option('--rate', default=10.0, type=float, help='batch mode: max requests per second sent to console'),
+    ]
+    for option in reversed(options):
+        f = option(f)
+    return f
+
+
+def read_appnames(apps, apps_file, appname=None):
+    """app names from --apps and --apps-file, empty list when not in batch mode.
+    appname is the APPNAME argument, batch mode has no use for it, so it's
+    most likely another argument shifted into its place"""
+    if appname and (apps or apps_file):
+        fatal("APPNAME argument can't be used with --apps or --apps-file, got {}".format(appname))
+    names = []
+    if apps:
+        names.extend(apps.split(','))
+    if apps_file:
+        for line in apps_file:
+            line = line.split('#', 1)[0]
+            names.extend(line.split())
+    result = []
+    for name in names:
+        name = name.strip()
+        if name and name not in result:
+            result.append(name)
+    if (apps or apps_file) and not result:
+        fatal('no app found in --apps or --apps-file')
+    return result
+
+
+class RateLimiter(object):
+    """allow at most `rate` calls of wait() per second across threads"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.lock = threading.Lock()
+        self.next_time = 0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.time()
+            wait_until = max(self.next_time, now)
+            self.next_time = wait_until + self.interval
+        if wait_until > now:
+            time.sleep(wait_until - now)
+
+
+def run_batch(kae, appnames, action, concurrency=8, rate=10.0, fmt=None):
+    """call action(api, appname) for every app in a bounded thread pool.
+    if action returns a str, it's shown as the result of the app. errors are collected
+    per app instead of exiting on the first failure, a summary table is
+    printed at the end and the process exits with 1 if any app failed.
+    with fmt json, ndjson or yaml, what action returned for the apps which
+    succeeded is printed to stdout in fmt, and the progress, the table and
+    the summary go to stderr, so stdout stays parsable."""
+    from kaelib import KaeAPIError
+    from kae.output import echo_data
+
+    data_only = fmt in ('json', 'ndjson', 'yaml')
+    local = threading.local()
+    limiter = RateLimiter(rate)
+
+    def run(appname):
+        # requests.Session is not thread safe, every worker owns a KaeAPI
+        if not hasattr(local, 'api'):
+            local.api = clone_kae_api(kae, kae.cluster)
+        limiter.wait()
+        start = time.time()
+        try:
+            result = action(local.api, appname)
+            return appname, 'ok', result, time.time() - start
+        except KaeAPIError as e:
+            return appname, 'failed', format_console_err(e), time.time() - start
+        except Exception as e:
+            return appname, 'failed', '{}: {}'.format(type(e).__name__, str(e)), time.time() - start
+
+    start = time.time()
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        futures = [executor.submit(run, appname) for appname in appnames]
+        for future in as_completed(futures):
+            appname, status, _, elapsed = r = future.result()
+            click.echo((info if status == 'ok' else error)('{} {} {:.0f}ms'.format(appname, status, elapsed * 1000)),
+                       err=data_only)
+            results[appname] = r
+    results = [results[appname] for appname in appnames]
+
+    if data_only:
+        echo_data([r[2] for r in results if r[1] == 'ok'], fmt)
+
+    table = PrettyTable(['app', 'status', 'latency', 'result'])
+    table.align['result'] = 'l'
+    for appname, status, result, elapsed in results:
+        table.add_row([appname, status, '{:.0f}ms'.format(elapsed * 1000), result if isinstance(result, str) else ''])
+    click.echo(table, err=data_only)
+
+    failed = len([r for r in results if r[1] != 'ok'])
+    summary = '{} apps, {} failed, {:.1f}s'.format(len(results), failed, time.time() - start)
+    if failed:
+        click.echo(error(summary), err=data_only)
+        sys.exit(1)
+    click.echo(info(summary), err=data_only)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+one zip with local python packages and their requirements, for spark py-files.
+
+the zip is deterministic(sorted entries, fixed timestamps and permissions, no
+bytecode) and named after a hash of its inputs, so the same inputs always give
+the same file, which is built once and kept in the cache dir.
+"""
+from __future__ import print_function, division, absolute_import
+import os
+import sys
+import shutil
+import platform
+import hashlib
+import zipfile
+import tempfile
+import subprocess
+
+from kae.utils import get_cache_dir, mkdir_p
+
+_BUNDLE_VERSION = 1
+# zip can't store dates before 1980
+_ZIP_DATE = (1980, 1, 1, 0, 0, 0)
+_SKIP_DIRS = ('__pycache__', '.git', '.hg', '.svn', '.tox', '.eggs')
+_SKIP_EXTS = ('.pyc', '.pyo')
+
+
+class BundleError(Exception):
+    pass
+
+
+def _walk(root):
+    """relative paths of the files under root, sorted"""
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in _SKIP_DIRS and not d.endswith('.egg-info')]
+        for fname in filenames:
+            if fname.endswith(_SKIP_EXTS):
+                continue
+            paths.append(os.path.relpath(os.path.join(dirpath, fname), root).replace(os.sep, '/'))
+    return sorted(paths)
+
+
+def bundle_key(package_dirs, requirements=None):
+    """hash of everything which ends up in the bundle, and of the interpreter,
+    pip picks wheels for its version, ABI and platform"""
+    h = hashlib.sha256('kae-bundle-{}'.format(_BUNDLE_VERSION).encode('utf-8'))
+    h.update('\0{}.{}\0{}\0{}\0{}\0'.format(sys.version_info[0], sys.version_info[1], sys.implementation.cache_tag,
+                                         sys.platform, platform.machine()).encode('utf-8'))
+    for pkg in package_dirs:
+        name = os.path.basename(os.path.abspath(pkg))
+        for rel in _walk(pkg):
+            h.update('\0{}/{}\0'.format(name, rel).encode('utf-8'))
+            with open(os.path.join(pkg, rel), 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    h.update(chunk)
+    if requirements:
+        with open(requirements, 'rb') as f:
+            h.update(b'\0requirements\0' + f.read())
+    return h.hexdigest()
+
+
+def _add_tree(zf, root, prefix='', skip_top=()):
+    for rel in _walk(root):
+        if rel.split('/', 1)[0] in skip_top:
+            continue
+        info = zipfile.ZipInfo(prefix + rel, date_time=_ZIP_DATE)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = 0o644 << 16
+        with open(os.path.join(root, rel), 'rb') as f:
+            zf.writestr(info, f.read())
+
+
+def _pip_install(requirements, target):
+    cmd = [sys.executable, '-m', 'pip', 'install', '--quiet', '--no-compile',
+           '--disable-pip-version-check', '--target', target, '-r', requirements]
+    if subprocess.call(cmd):
+        raise BundleError('pip install -r {} failed'.format(requirements))
+
+
+def build_bundle(package_dirs, requirements=None, name='pyfiles', force=False):
+    """return (path of the bundle in the cache dir, True if it was built now)"""
+    for pkg in package_dirs:
+        if not os.path.isdir(pkg):
+            raise BundleError('{} is not a directory'.format(pkg))
+    if requirements and not os.path.isfile(requirements):
+        raise BundleError('{} not exist'.format(requirements))
+
+    key = bundle_key(package_dirs, requirements)
+    path = get_cache_dir('bundles', '{}-{}.zip'.format(name, key[:16]))
+    if os.path.exists(path) and not force:
+        return path, False
+
+    mkdir_p(os.path.dirname(path))
+    tmp_dir = tempfile.mkdtemp(prefix='kae-bundle-')
+    tmp_zip = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        if requirements:
+            _pip_install(requirements, os.path.join(tmp_dir, 'deps'))
+        with zipfile.ZipFile(tmp_zip, 'w') as zf:
+            if requirements:
+                # console scripts carry the shebang of this machine's python
+                _add_tree(zf, os.path.join(tmp_dir, 'deps'), skip_top=('bin', ))
+            for pkg in package_dirs:
+                _add_tree(zf, pkg, os.path.basename(os.path.abspath(pkg)) + '/')
+        os.replace(tmp_zip, path)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if os.path.exists(tmp_zip):
+            os.remove(tmp_zip)
+    return path, True
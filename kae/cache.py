@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+local cache of the console responses which rarely change.
+
+ResponseCache.install wraps KaeAPI.request, so every kaelib method goes
+through it:
+ * GETs of the paths in CACHE_TTLS are served from the cache dir while
+   fresh. stale entries are revalidated with If-None-Match/If-Modified-Since
+   when the console sent an ETag/Last-Modified, a 304 keeps the cached body.
+ * any other method naming an app, in the path or as `appname` of the
+   payload, drops all cached responses of that app, deploy, register,
+   delete, rollback and friends included.
+reads are only cached when enabled(`kae --response-cache`), invalidation
+always runs so an uncached deploy never leaves stale entries behind.
+"""
+from __future__ import print_function, division, absolute_import
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from urllib.parse import urljoin
+
+from kae.utils import get_cache_dir, write_json_file
+
+logger = logging.getLogger(__name__)
+
+# (path pattern, seconds), the first group is the appname
+CACHE_TTLS = (
+    (re.compile(r'^app/([^/]+)$'), 60),
+    (re.compile(r'^app/([^/]+)/releases$'), 30),
+    # a release only changes when it's registered again with --force
+    (re.compile(r'^app/([^/]+)/version/[^/]+$'), 3600),
+)
+_APP_PATH = re.compile(r'^app/([^/]+)')
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+
+
+class ResponseCache(object):
+    """json files under <cache dir>/responses/<appname>/, the least recently
+    used are removed once they take more than max_bytes"""
+
+    def __init__(self, enabled=False, path=None, max_bytes=DEFAULT_CACHE_SIZE):
+        self.enabled = enabled
+        self.path = path or get_cache_dir('responses')
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._lock = threading.Lock()
+        # bytes on disk, counted on the first write
+        self._size = None
+
+    def install(self, kae):
+        request = kae.request
+
+        def cached_request(path, method='GET', params=None, data=None, json=None, files=None, **kwargs):
+            ttl, appname = _match(path)
+            if method.upper() == 'GET' and self.enabled and ttl is not None and not (data or json or files or kwargs):
+                return self.get(kae, path, params, ttl, appname)
+            if method.upper() != 'GET':
+                self.invalidate(_mutated_app(path, json))
+            return request(path, method=method, params=params, data=data, json=json, files=files, **kwargs)
+
+        kae.request = cached_request
+        kae.response_cache = self
+        return kae
+
+    def _entry_path(self, kae, path, params, appname):
+        key = '{}\0{}\0{}'.format(kae.base, path, sorted((params or {}).items()))
+        return os.path.join(self.path, appname, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, kae, path, params, ttl, appname):
+        from kaelib import KaeAPIError
+
+        entry_path = self._entry_path(kae, path, params, appname)
+        entry = _read_entry(entry_path)
+        now = time.time()
+        if entry and entry['expires'] > now:
+            self.hits += 1
+            logger.debug('response cache hit %s', path)
+            # mtime orders the entries for eviction
+            _touch(entry_path)
+            return entry['body']
+
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        resp = kae.session.request(url=urljoin(kae.base, path), method='GET', params=params or {},
+                                   timeout=kae.timeout, headers=headers)
+        if resp.status_code == 304 and entry:
+            self.revalidated += 1
+            logger.debug('response cache revalidated %s', path)
+            entry['expires'] = now + ttl
+            self._save(entry_path, entry)
+            return entry['body']
+        if resp.status_code != 200:
+            raise KaeAPIError(resp.status_code, resp.text)
+        try:
+            body = resp.json()
+        except ValueError:
+            raise KaeAPIError(500, 'BUG: Console did not return json, body {}'.format(resp.text))
+
+        self.misses += 1
+        logger.debug('response cache miss %s', path)
+        self._save(entry_path, {
+            'expires': now + ttl,
+            'etag': resp.headers.get('ETag'),
+            'last_modified': resp.headers.get('Last-Modified'),
+            'body': body,
+        })
+        return body
+
+    def invalidate(self, appname):
+        if not appname or appname in ('.', '..'):
+            return
+        app_dir = os.path.join(self.path, appname)
+        if os.path.isdir(app_dir):
+            logger.debug('response cache of %s invalidated', appname)
+            shutil.rmtree(app_dir, ignore_errors=True)
+            with self._lock:
+                self._size = None
+
+    def _save(self, entry_path, entry):
+        try:
+            old_size = os.path.getsize(entry_path) if os.path.exists(entry_path) else 0
+            write_json_file(entry, entry_path, mode=0o600)
+            new_size = os.path.getsize(entry_path)
+        except (OSError, IOError):
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += new_size - old_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        """(mtime, size, path) of every cached response"""
+        entries = []
+        try:
+            app_dirs = os.listdir(self.path)
+        except OSError:
+            return entries
+        for appname in app_dirs:
+            app_dir = os.path.join(self.path, appname)
+            try:
+                names = os.listdir(app_dir)
+            except OSError:
+                continue
+            for name in names:
+                try:
+                    st = os.stat(os.path.join(app_dir, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, os.path.join(app_dir, name)))
+        return entries
+
+    def _evict(self):
+        # down to 3/4 of the bound, so it's not done again on the next write
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._size <= self.max_bytes * 3 // 4:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+
+
+def _match(path):
+    for pattern, ttl in CACHE_TTLS:
+        m = pattern.match(path)
+        if m and m.group(1) not in ('.', '..'):
+            return ttl, m.group(1)
+    return None, None
+
+
+def _mutated_app(path, payload):
+    if isinstance(payload, dict) and payload.get('appname'):
+        return payload['appname']
+    m = _APP_PATH.match(path)
+    return m.group(1) if m else None
+
+
+def _read_entry(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, IOError, ValueError):
+        return None
+
+
+def _touch(path):
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
@@ -7,29 +7,82 @@
 from __future__ import print_function, division, absolute_import
 import sys
 import logging
+import importlib
 from os import getenv
 from os.path import expanduser
 
 import click
 
-from kaelib import KaeAPI
-
 from kae import __VERSION__
 from kae.commands import commands
-from kae.utils import read_yaml_file, write_yaml_file, error, get_sso_token
-
-__local_commands = ("version", "test", "create-web-app", "build")
-
-
-@click.group(invoke_without_command=True)
+from kae.output import OUTPUT_FORMATS
+from kae.utils import (
+    read_yaml_file, write_yaml_file, error, get_sso_token_entry, get_token_cache_path,
+)
+
+__local_commands = ("version", "test", "create-web-app", "build", "build:context", "auth:status", "auth:logout")
+# commands which are local only with this option
+__local_options = {"spark:bundle": "no_upload"}
+
+
+class LazyGroup(click.Group):
+    """click group which imports the module of a command only when the
+    command is invoked or its help is rendered, so `kae version` doesn't pay
+    for importing kaelib, keycloak and friends.
+    lazy_commands maps command name to `module:function`."""
+
+    def __init__(self, *args, **kwargs):
+        self.lazy_commands = kwargs.pop('lazy_commands', {})
+        super(LazyGroup, self).__init__(*args, **kwargs)
+
+    def list_commands(self, ctx):
+        names = set(super(LazyGroup, self).list_commands(ctx))
+        return sorted(names | set(self.lazy_commands))
+
+    def get_command(self, ctx, cmd_name):
+        cmd = super(LazyGroup, self).get_command(ctx, cmd_name)
+        if cmd is None and cmd_name in self.lazy_commands:
+            module_name, func_name = self.lazy_commands[cmd_name].split(':')
+            func = getattr(importlib.import_module(module_name), func_name)
+            cmd = click.command(cmd_name)(func)
+            self.add_command(cmd)
+        return cmd
+
+    def invoke(self, ctx):
+        # the group callback runs before the sub command parses its args,
+        # remember whether it only renders help
+        ctx.meta['kae.sub_options'] = self.peek_options(ctx)
+        ctx.meta['kae.help_only'] = bool(ctx.meta['kae.sub_options'].get('help'))
+        return super(LazyGroup, self).invoke(ctx)
+
+    def peek_options(self, ctx):
+        """options the sub command will get, parsed by its own parser in
+        resilient mode, so `--msg --help` is a value of --msg, not help"""
+        if not ctx.protected_args:
+            return {}
+        cmd = self.get_command(ctx, ctx.protected_args[0])
+        if cmd is None:
+            return {}
+        sub_ctx = click.Context(cmd, info_name=ctx.protected_args[0], parent=ctx, resilient_parsing=True)
+        opts, _, _ = cmd.make_parser(sub_ctx).parse_args(args=list(ctx.args))
+        return opts
+
+
+@click.group(cls=LazyGroup, lazy_commands=commands, invoke_without_command=True)
 @click.option('--config-path', default=expanduser('~/.kae/config.yaml'),
               help='config file, yaml', envvar='KAE_CONFIG_PATH')
 @click.option('--remotename', default='origin', help='git remote name, default to origin', envvar='KAE_REPO_NAME')
 @click.option('--debug', default=False, help='enable debug output', is_flag=True)
 @click.option('--totp', default=None, help='time-based one time password')
+@click.option('--no-token-cache', default=False, is_flag=True, envvar='KAE_NO_TOKEN_CACHE',
+              help="don't read or write the cached sso token")
+@click.option('--response-cache', default=False, is_flag=True, envvar='KAE_RESPONSE_CACHE',
+              help='cache the responses of app, release and release list queries locally')
+@click.option('-o', '--output', type=click.Choice(OUTPUT_FORMATS), envvar='KAE_OUTPUT',
+              help='output format of the read commands, default to table')
 @click.option('-v', '--version', default=False, help='show version', is_flag=True)
 @click.pass_context
-def kae_commands(ctx, config_path, remotename, debug, totp, version):
+def kae_commands(ctx, config_path, remotename, debug, totp, no_token_cache, response_cache, output, version):
     if ctx.invoked_subcommand is None:
         if version:
             print("KAE version: {}".format(__VERSION__))
@@ -39,8 +92,17 @@ def kae_commands(ctx, config_path, remotename, debug, totp, version):
             sys.exit(-1)
 
     ctx.obj['debug'] = debug
+    ctx.obj['config_path'] = config_path
+    ctx.obj['output'] = output
+
+    # `kae app:get --help` needs neither config nor sso token
+    local_option = __local_options.get(ctx.invoked_subcommand)
+    local = (ctx.invoked_subcommand in __local_commands or ctx.meta.get('kae.help_only') or
+             bool(local_option and ctx.meta.get('kae.sub_options', {}).get(local_option)))
+    if not local:
+        from kaelib import KaeAPI
+        from kae.cache import ResponseCache
 
-    if ctx.invoked_subcommand not in __local_commands:
         config = read_yaml_file(config_path)
         if not config:
             config = {}
@@ -57,21 +119,24 @@ def kae_commands(ctx, config_path, remotename, debug, totp, version):
         if debug:
             logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] [%(process)d] [%(levelname)s] [%(filename)s @ %(lineno)s]: %(message)s', datefmt='%Y-%m-%d %H:%M:%S %z')
 
-        token = get_sso_token(
+        token_entry = get_sso_token_entry(
             user=config['sso_username'],
             password=config['sso_password'],
             sso_host=config['sso_host'],
             realm=config.get('sso_realm', "kae"),
             client_id=config.get('sso_client_id', "kae-cli"),
-            totp=totp
+            totp=totp,
+            cache_path=None if no_token_cache else get_token_cache_path(config_path),
         )
-        kae_api = KaeAPI(config['kae_url'].strip('/'), access_token=token)
+        kae_api = KaeAPI(config['kae_url'].strip('/'), access_token=token_entry['access_token'])
+        ResponseCache(enabled=response_cache).install(kae_api)
         ctx.obj['kae_api'] = kae_api
         ctx.obj['remotename'] = remotename
-
-
-for command, function in commands.items():
-    kae_commands.command(command)(function)
+        # for the commands which need to login again, e.g. `kae shell`
+        ctx.obj['config'] = config
+        ctx.obj['totp'] = totp
+        ctx.obj['token_entry'] = token_entry
+        ctx.obj['token_cache_path'] = None if no_token_cache else get_token_cache_path(config_path)
 
 
 @kae_commands.command()
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+the build context docker sends, selected by .dockerignore the way docker
+does it, and the digests of local builds and test entrypoints, so a build
+or a test whose inputs didn't change can be skipped.
+"""
+from __future__ import print_function, division, absolute_import
+import os
+import re
+import stat
+import time
+import fnmatch
+import hashlib
+import threading
+from collections import OrderedDict
+
+from kae.utils import get_cache_dir, read_json_file, write_json_file
+
+_DIGEST_VERSION = 1
+# entries kept in the build and test indexes and in the file hash cache of a root
+_BUILD_INDEX_SIZE = 500
+_TEST_INDEX_SIZE = 1000
+_HASH_CACHE_SIZE = 200000
+_HASH_CACHE_ROOTS = 200
+# the cache files are written by the threads of `kae build --parallel`
+_write_lock = threading.Lock()
+
+
+def read_dockerignore(context):
+    """patterns of the .dockerignore of context, [] if there is none"""
+    try:
+        with open(os.path.join(context, '.dockerignore')) as f:
+            lines = f.read().splitlines()
+    except (OSError, IOError):
+        return []
+    return [line.strip() for line in lines if line.strip() and not line.strip().startswith('#')]
+
+
+def _compile(pattern):
+    """regex of a .dockerignore pattern, the syntax of filepath.Match plus `**`"""
+    regex = '^'
+    in_class = False
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == '\\' and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        elif in_class:
+            # only `-` and the closing `]` are special in a bracket expression
+            if ch == ']':
+                in_class = False
+                regex += ch
+            elif ch == '-':
+                regex += ch
+            else:
+                regex += re.escape(ch)
+        elif ch == '*':
+            if pattern[i + 1:i + 2] == '*':
+                i += 1
+                if pattern[i + 1:i + 2] == '/':
+                    # `**/` matches zero or more dirs
+                    regex += '(.*/)?'
+                    i += 1
+                else:
+                    regex += '.*'
+            else:
+                regex += '[^/]*'
+        elif ch == '?':
+            regex += '[^/]'
+        elif ch == '[':
+            in_class = True
+            if pattern[i + 1:i + 2] in ('!', '^'):
+                regex += '[^'
+                i += 1
+            else:
+                regex += '['
+        else:
+            regex += re.escape(ch)
+        i += 1
+    return re.compile(regex + '$')
+
+
+class DockerIgnore(object):
+    """the .dockerignore matcher of docker: the last pattern matching a path,
+    or its parent dir at the depth of the pattern, decides, patterns
+    starting with `!` include the path again"""
+
+    def __init__(self, patterns):
+        self.rules = []
+        for p in patterns:
+            exception = p.startswith('!')
+            if exception:
+                p = p[1:].strip()
+            p = os.path.normpath(p).replace(os.sep, '/').lstrip('/')
+            if p in ('', '.'):
+                continue
+            self.rules.append((_compile(p), len(p.split('/')), exception))
+        self.has_exceptions = any(exception for _, _, exception in self.rules)
+
+    def excluded(self, rel):
+        """rel is the slash separated path relative to the context"""
+        parts = rel.split('/')
+        excluded = False
+        for regex, depth, exception in self.rules:
+            matched = regex.match(rel) is not None
+            if not matched and len(parts) > 1 and depth < len(parts):
+                matched = regex.match('/'.join(parts[:depth])) is not None
+            if matched:
+                excluded = not exception
+        return excluded
+
+
+def walk_context(context, ignore=None):
+    """yield (relative path, lstat) of every file docker sends, in a stable
+    order. symlinks are files, dirs excluded without any `!` pattern are
+    not entered at all."""
+    if ignore is None:
+        ignore = DockerIgnore(read_dockerignore(context))
+    for dirpath, dirnames, filenames in os.walk(context):
+        rel_dir = os.path.relpath(dirpath, context).replace(os.sep, '/')
+        prefix = '' if rel_dir == '.' else rel_dir + '/'
+        keep = []
+        for name in sorted(dirnames):
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path):
+                filenames.append(name)
+            elif not (ignore.excluded(prefix + name) and not ignore.has_exceptions):
+                keep.append(name)
+        dirnames[:] = keep
+        for name in sorted(filenames):
+            rel = prefix + name
+            if ignore.excluded(rel):
+                continue
+            try:
+                st = os.lstat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            yield rel, st
+
+
+# dirs which are almost never needed in an image
+_HEAVY_DIRS = ('.git', '.hg', '.svn', 'node_modules', '__pycache__', '.venv', 'venv', '.tox', '.nox',
+               '.pytest_cache', '.mypy_cache', '.idea', '.vscode', '.gradle', '.terraform')
+_HEAVY_FILES = ('*.pyc', '*.pyo', '*.swp', '*.log', '.DS_Store')
+# single files this large are listed in the suggestion
+LARGE_FILE_SIZE = 50 * 1024 * 1024
+
+
+class ContextStats(object):
+    """size of a build context as docker sends it"""
+
+    def __init__(self, context, depth=2):
+        self.context = context
+        self.depth = depth
+        self.total_size = 0
+        self.file_count = 0
+        # {dir: [bytes, files]} of the dirs up to depth, subdirs included
+        self.dirs = {}
+        self.large_files = []
+        # patterns of _HEAVY_DIRS and _HEAVY_FILES found in the context
+        self.heavy = set()
+
+    def add(self, rel, st):
+        size = st.st_size if stat.S_ISREG(st.st_mode) else 0
+        self.total_size += size
+        self.file_count += 1
+        parts = rel.split('/')
+        for i in range(1, min(len(parts), self.depth + 1)):
+            entry = self.dirs.setdefault('/'.join(parts[:i]), [0, 0])
+            entry[0] += size
+            entry[1] += 1
+        for i, part in enumerate(parts[:-1]):
+            if part in _HEAVY_DIRS:
+                self.heavy.add(part if i == 0 else '**/' + part)
+                break
+        else:
+            for pattern in _HEAVY_FILES:
+                if fnmatch.fnmatch(parts[-1], pattern):
+                    self.heavy.add('**/' + pattern)
+        if size >= LARGE_FILE_SIZE:
+            self.large_files.append((size, rel))
+
+    def largest_dirs(self, n=10):
+        return sorted(self.dirs.items(), key=lambda kv: -kv[1][0])[:n]
+
+    def upload_seconds(self, bandwidth):
+        """time to send the context at bandwidth bytes/s, tar adds a 512
+        bytes header to every file"""
+        return (self.total_size + 512 * self.file_count) / float(bandwidth)
+
+    def suggest_dockerignore(self, patterns):
+        """lines of a .dockerignore, the existing patterns and what's missing"""
+        lines = list(patterns)
+        missing = sorted(self.heavy - set(patterns))
+        if missing:
+            lines += ['# not needed in the image'] + missing
+        ignore = DockerIgnore(lines)
+        large = [rel for _, rel in sorted(self.large_files, reverse=True) if not ignore.excluded(rel)]
+        if large:
+            lines += ['# large files, keep them if the Dockerfile copies them'] + large
+        return lines
+
+
+def analyze_context(context, depth=2):
+    stats = ContextStats(context, depth=depth)
+    for rel, st in walk_context(context):
+        stats.add(rel, st)
+    return stats
+
+
+class FileHashes(object):
+    """sha256 of files, cached by path, size, mtime and inode.
+
+    the hashes are stored per root(a build context or a volume source), one
+    json file each, so a save only rewrites the roots hashed by this run.
+    inside a root the least recently used hashes go first, and the least
+    recently saved roots go when there are more than _HASH_CACHE_ROOTS"""
+
+    def __init__(self, path=None):
+        self.path = path or get_cache_dir('context_hashes')
+        # root -> OrderedDict(path -> [size, mtime, inode, digest]), oldest first
+        self.roots = {}
+        # root -> paths used by this run, in order
+        self.used = {}
+
+    def _root_path(self, root):
+        return os.path.join(self.path, hashlib.sha256(root.encode('utf-8')).hexdigest()[:20] + '.json')
+
+    def get(self, path, st, root):
+        root = os.path.abspath(root)
+        if root not in self.roots:
+            self.roots[root] = OrderedDict(_read_json(self._root_path(root)))
+            self.used[root] = OrderedDict()
+        hashes = self.roots[root]
+        key = [st.st_size, st.st_mtime_ns, st.st_ino]
+        cached = hashes.get(path)
+        if not (cached and cached[:3] == key):
+            h = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    h.update(chunk)
+            cached = hashes[path] = key + [h.hexdigest()]
+        self.used[root][path] = cached
+        return cached[3]
+
+    def save(self):
+        if not any(self.used.values()):
+            return
+        with _write_lock:
+            for root, used in self.used.items():
+                path = self._root_path(root)
+                # other processes may have saved this root meanwhile
+                hashes = OrderedDict(_read_json(path))
+                for p, entry in used.items():
+                    hashes.pop(p, None)
+                    hashes[p] = entry
+                while len(hashes) > _HASH_CACHE_SIZE:
+                    hashes.popitem(last=False)
+                try:
+                    write_json_file(hashes, path)
+                except (OSError, IOError):
+                    pass
+            self.used = {root: OrderedDict() for root in self.used}
+            self._evict_roots()
+
+    def _evict_roots(self):
+        try:
+            names = [n for n in os.listdir(self.path) if n.endswith('.json')]
+            paths = sorted((os.path.join(self.path, n) for n in names), key=os.path.getmtime)
+            for path in paths[:max(len(paths) - _HASH_CACHE_ROOTS, 0)]:
+                os.remove(path)
+        except (OSError, IOError):
+            pass
+
+
+def context_digest(context, dockerfile, build_args=None, extra=(), hashes=None):
+    """sha256 over the Dockerfile, build args, extra strings and the files
+    of the context, the build output is the same as long as it is"""
+    own_hashes = hashes is None
+    if own_hashes:
+        hashes = FileHashes()
+    h = hashlib.sha256('kae-build-{}'.format(_DIGEST_VERSION).encode('utf-8'))
+    with open(dockerfile, 'rb') as f:
+        h.update(b'\0dockerfile\0' + f.read())
+    for arg in build_args or []:
+        h.update('\0arg\0{}'.format(arg).encode('utf-8'))
+    for s in extra:
+        h.update('\0extra\0{}'.format(s).encode('utf-8'))
+    for rel, st in walk_context(context):
+        path = os.path.join(context, rel)
+        if stat.S_ISLNK(st.st_mode):
+            content = 'link:' + os.readlink(path)
+        elif stat.S_ISREG(st.st_mode):
+            content = hashes.get(os.path.abspath(path), st, context)
+        else:
+            continue
+        # docker keeps the permission bits
+        h.update('\0{}\0{:o}\0{}'.format(rel, stat.S_IMODE(st.st_mode), content).encode('utf-8'))
+    if own_hashes:
+        hashes.save()
+    return h.hexdigest()
+
+
+def tree_digest(path, hashes=None):
+    """sha256 over a file or every file under a dir, .dockerignore is not
+    applied, e.g. the source of a bind mount. None if path doesn't exist"""
+    own_hashes = hashes is None
+    if own_hashes:
+        hashes = FileHashes()
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    h = hashlib.sha256('kae-tree-{}'.format(_DIGEST_VERSION).encode('utf-8'))
+    if stat.S_ISDIR(st.st_mode):
+        entries = walk_context(path, ignore=DockerIgnore([]))
+    else:
+        entries = [('', st)]
+    for rel, st in entries:
+        file_path = os.path.join(path, rel) if rel else path
+        if stat.S_ISLNK(st.st_mode):
+            content = 'link:' + os.readlink(file_path)
+        elif stat.S_ISREG(st.st_mode):
+            content = hashes.get(os.path.abspath(file_path), st, path)
+        else:
+            continue
+        h.update('\0{}\0{:o}\0{}'.format(rel, stat.S_IMODE(st.st_mode), content).encode('utf-8'))
+    if own_hashes:
+        hashes.save()
+    return h.hexdigest()
+
+
+def entrypoint_digest(image_id, script, volumes, hashes=None):
+    """sha256 over the image id, the script and the volumes of a test
+    entrypoint, with the content of the bind mounted files. None if a
+    volume is a named one, kae can't tell what's in it"""
+    own_hashes = hashes is None
+    if own_hashes:
+        hashes = FileHashes()
+    h = hashlib.sha256('kae-test-{}'.format(_DIGEST_VERSION).encode('utf-8'))
+    h.update('\0image\0{}'.format(image_id).encode('utf-8'))
+    for cmd in script:
+        h.update('\0step\0{}'.format(cmd).encode('utf-8'))
+    for volume in volumes:
+        src = volume.split(':', 1)[0]
+        if not src.startswith(('/', '.', '~')):
+            return None
+        digest = tree_digest(os.path.expanduser(src), hashes=hashes)
+        h.update('\0volume\0{}\0{}'.format(volume, digest).encode('utf-8'))
+    if own_hashes:
+        hashes.save()
+    return h.hexdigest()
+
+
+class BuildIndex(object):
+    """build digest -> id of the image built from it"""
+
+    def __init__(self, path=None):
+        self.path = path or get_cache_dir('builds.json')
+
+    def lookup(self, digest):
+        entry = _read_json(self.path).get(digest)
+        return entry['image_id'] if entry else None
+
+    def record(self, digest, image, image_id):
+        _record(self.path, digest, {'image': image, 'image_id': image_id, 'time': time.time()},
+                _BUILD_INDEX_SIZE)
+
+
+class TestIndex(object):
+    """entrypoint digest -> its last passed run, with KAE_CACHE_DIR in the
+    cache dir of CI it's shared by the pipelines"""
+
+    def __init__(self, path=None):
+        self.path = path or get_cache_dir('tests.json')
+
+    def lookup(self, digest):
+        return _read_json(self.path).get(digest)
+
+    def record(self, digest, image, image_id, duration):
+        _record(self.path, digest, {'image': image, 'image_id': image_id, 'duration': duration,
+                                    'time': time.time()}, _TEST_INDEX_SIZE)
+
+
+def _record(path, key, entry, size):
+    """set key of the json index at path, the oldest entries go beyond size"""
+    with _write_lock:
+        index = _read_json(path)
+        index.pop(key, None)
+        index[key] = entry
+        if len(index) > size:
+            index = dict(list(index.items())[-size:])
+        try:
+            write_json_file(index, path)
+        except (OSError, IOError):
+            pass
+
+
+def _read_json(path):
+    try:
+        data = read_json_file(path)
+    except ValueError:
+        data = None
+    return data if isinstance(data, dict) else {}
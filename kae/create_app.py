@@ -7,14 +7,11 @@
 from __future__ import print_function, division, absolute_import
 import os
 import shutil
-from jinja2 import Template
-from pkg_resources import resource_string, resource_filename
 
 import click
 from kae.utils import (
     get_appname, get_current_branch, get_remote_url, get_git_tag,
     get_specs_text, error, info, fatal, handle_console_err,
-    display_pods,
 )
 
 
@@ -36,6 +33,9 @@ def create_web_app(ctx, app_type):
 
 
 def _common():
+    from jinja2 import Template
+    from pkg_resources import resource_string, resource_filename
+
     app_yaml_tpl = Template(resource_string(__name__, "tpl/app.yaml").decode('utf8'))
 
     appname = click.prompt(info('Please enter app name'), type=str)
@@ -64,6 +64,9 @@ def _common():
 
 
 def create_flask_app():
+    from jinja2 import Template
+    from pkg_resources import resource_string, resource_filename
+
     mappings = _common()
 
     dockerfile_tpl = Template(resource_string(__name__, "tpl/flask/Dockerfile").decode('utf8'))
@@ -92,6 +95,9 @@ def create_flask_app():
 
 
 def create_tornado_app():
+    from jinja2 import Template
+    from pkg_resources import resource_string, resource_filename
+
     mappings = _common()
 
     dockerfile_tpl = Template(resource_string(__name__, "tpl/tornado/Dockerfile").decode('utf8'))
@@ -110,6 +116,9 @@ def create_tornado_app():
 
 
 def create_go_app():
+    from jinja2 import Template
+    from pkg_resources import resource_string
+
     mappings = _common()
 
     dockerfile_tpl = Template(resource_string(__name__, "tpl/go/Dockerfile").decode('utf8'))
@@ -124,6 +133,9 @@ def create_go_app():
 
 
 def create_node_app():
+    from jinja2 import Template
+    from pkg_resources import resource_string
+
     mappings = _common()
 
     dockerfile_tpl = Template(resource_string(__name__, "tpl/node/Dockerfile").decode('utf8'))
@@ -6,15 +6,24 @@
 """
 from __future__ import print_function, division, absolute_import
 import os
+import re
+import time
 import shlex
+import threading
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 import click
+from prettytable import PrettyTable
 
-from .utils import info, error, fatal
+from .utils import info, warn, error, fatal
+from .context import BuildIndex, context_digest
 
+_echo_lock = threading.Lock()
 
-def _docker(args, cwd=None, env=os.environ, capture_output=False, print_stdout=True):
+
+def _docker(args, cwd=None, env=os.environ, capture_output=False, print_stdout=True, prefix=None, procs=None,
+            on_line=None):
     """
     Wrapper of Docker client. Use subprocess instead of docker-py to
     avoid API version inconsistency problems.
@@ -22,6 +31,12 @@ def _docker(args, cwd=None, env=os.environ, capture_output=False, print_stdout=T
         args: Argument list to pass to Docker client.
         cwd: Current working directory to run Docker under.
         env: Environemnt variable dict to pass to Docker client.
+        prefix: if not None, every output line is printed after it, so
+            the output of concurrent clients can be told apart.
+        procs: if not None, the running Popen is added to it while the
+            client runs, so another thread can terminate it.
+        on_line: if not None, it's called with every output line instead
+            of printing it.
     Returns:
         Combined output of stdout + stderr, or return code (int).
     Raises:
@@ -31,7 +46,23 @@ def _docker(args, cwd=None, env=os.environ, capture_output=False, print_stdout=T
     cmd = ['docker'] + args
     env = dict(env)
 
-    if capture_output:
+    if prefix is not None or on_line is not None:
+        if on_line is None:
+            def on_line(line):
+                with _echo_lock:
+                    click.echo(prefix + line)
+        proc = subprocess.Popen(cmd, env=env, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        if procs is not None:
+            procs.add(proc)
+        try:
+            for line in iter(proc.stdout.readline, b''):
+                on_line(line.decode('utf-8', 'replace').rstrip('\r\n'))
+            return proc.wait()
+        finally:
+            proc.stdout.close()
+            if procs is not None:
+                procs.discard(proc)
+    elif capture_output:
         try:
             output = subprocess.check_output(
                 cmd, env=env, cwd=cwd, stderr=subprocess.STDOUT)
@@ -44,25 +75,128 @@ def _docker(args, cwd=None, env=os.environ, capture_output=False, print_stdout=T
         return retcode
 
 
-def build_image(name, context, build_args, dockerfile=None, use_cache=True):
-    click.echo(info('building image {} ...'.format(name)))
-    if use_cache:
-        options = ['-t', name, ]
-    else:
-        options = ['-t', name, '--no-cache', ]
-
-    if build_args:
-        options = ['-t', name]
-        for arg in build_args:
-            key, val = arg.split('=', 1)
-            if val.startswith('$'):
-                val = os.environ[val[1:]]
-            options.append('--build-arg')
-            options.append('{}={}'.format(key, val))
+def image_id(ref):
+    """id of a local image, None if it doesn't exist"""
+    output = _docker(['image', 'inspect', '--format', '{{.Id}}', ref], capture_output=True)
+    output = output.decode('utf-8', 'replace').strip()
+    return output if output.startswith('sha256:') else None
+
+
+def _resolve_build_args(build_args, prefix=''):
+    """KEY=VAL list, a VAL of `$NAME` is read from the environment. an arg
+    whose variable isn't set is left out, so the ARG default of the
+    Dockerfile applies, e.g. a token only CI has"""
+    resolved = []
+    for arg in build_args or []:
+        key, val = arg.split('=', 1)
+        if val.startswith('$'):
+            if val[1:] not in os.environ:
+                with _echo_lock:
+                    click.echo(warn('{}build arg {} skipped, {} is not set'.format(prefix, key, val)))
+                continue
+            val = os.environ[val[1:]]
+        resolved.append('{}={}'.format(key, val))
+    return resolved
+
+
+def _dockerfile_path(context, dockerfile=None):
+    """path of the Dockerfile, a relative one is in the context, like docker
+    resolves `-f` running in the context"""
+    return os.path.join(context, dockerfile or 'Dockerfile')
+
+
+def _build_digest(context, build_args, dockerfile=None, target=None):
+    """digest of the build inputs(build_args resolved already). the ids of
+    the local base images are part of it, so rebuilding a base image
+    invalidates the images on top of it"""
+    dockerfile = _dockerfile_path(context, dockerfile)
+    extra = ['{}={}'.format(b, image_id(b)) for b in sorted(_base_images(dockerfile))]
+    if target:
+        extra.append('target={}'.format(target))
+    return context_digest(context, dockerfile, build_args, extra=extra)
+
+
+def _cache_spec(value, key, context):
+    """--cache-from/--cache-to value, a dir(relative to the context) becomes a local cache"""
+    path = os.path.join(context, value)
+    if '=' not in value and (value.startswith(('.', '/')) or os.path.isdir(path)):
+        return 'type=local,{}={}'.format(key, os.path.abspath(path))
+    return value
+
+
+def _build_command(name, context, build_args, dockerfile=None, use_cache=True, target=None, cache=None):
+    """(docker args, extra env) of a build, build_args are resolved already.
+    cache is a dict of buildkit, cache_from, cache_to and inline_cache. a
+    cache_from image is supported by every builder, exporting cache or
+    importing a local dir cache needs `docker buildx build`, inline cache
+    and buildkit alone are enabled with DOCKER_BUILDKIT=1."""
+    cache = cache or {}
+    options = ['-t', name]
+    if not use_cache:
+        options.append('--no-cache')
+    build_args = list(build_args or [])
+    if cache.get('inline_cache'):
+        build_args.append('BUILDKIT_INLINE_CACHE=1')
+    for arg in build_args:
+        options += ['--build-arg', arg]
     if dockerfile is not None:
         options += ['-f', dockerfile]
-    docker_args = ['build'] + options + ['--network', 'host', '.']
-    retcode = _docker(docker_args, cwd=context)
+    if target:
+        options += ['--target', target]
+
+    cache_from = [_cache_spec(v, 'src', context) for v in cache.get('cache_from') or []]
+    cache_to = [_cache_spec(v, 'dest', context) for v in cache.get('cache_to') or []]
+    for v in cache_from:
+        options += ['--cache-from', v]
+    for v in cache_to:
+        options += ['--cache-to', v]
+    if cache_to or any(v.startswith('type=local') for v in cache_from):
+        # --load puts the image into the local image store, `kae test` runs it.
+        # no --network host, the docker-container driver needed to export
+        # cache refuses it unless the builder has the network.host entitlement
+        return ['buildx', 'build', '--load'] + options + ['.'], {}
+    env = {'DOCKER_BUILDKIT': '1'} if cache.get('buildkit') or cache.get('inline_cache') else {}
+    return ['build'] + options + ['--network', 'host', '.'], env
+
+
+def _build_image(name, context, build_args, dockerfile=None, use_cache=True, prefix=None, procs=None,
+                 skip_unchanged=False, target=None, cache=None):
+    """run docker build, return (return code, True if it was skipped).
+    the digest of every build is recorded. with skip_unchanged, the build is
+    skipped when an image was built from the same digest before and still
+    exists, name is tagged to it if needed."""
+    index = BuildIndex()
+    build_args = _resolve_build_args(build_args, prefix or '')
+    try:
+        digest = _build_digest(context, build_args, dockerfile, target)
+    except (OSError, IOError):
+        # let docker build report it
+        digest = None
+    if digest and skip_unchanged and use_cache:
+        built_id = index.lookup(digest)
+        if built_id and image_id(built_id) == built_id:
+            if image_id(name) == built_id or _docker(['tag', built_id, name], print_stdout=False) == 0:
+                with _echo_lock:
+                    click.echo(info('{}{} is up to date ({}), build skipped'.format(prefix or '', name, built_id[7:19])))
+                return 0, True
+
+    docker_args, env = _build_command(name, context, build_args, dockerfile=dockerfile, use_cache=use_cache,
+                                      target=target, cache=cache)
+    retcode = _docker(docker_args, cwd=context, env=dict(os.environ, **env), prefix=prefix, procs=procs)
+    if retcode == 0 and digest:
+        built_id = image_id(name)
+        if built_id:
+            index.record(digest, name, built_id)
+    return retcode, False
+
+
+def build_image(name, context, build_args, dockerfile=None, use_cache=True, skip_unchanged=False,
+                target=None, cache=None):
+    click.echo(info('building image {} ...'.format(name)))
+    retcode, skipped = _build_image(name, context, build_args, dockerfile=dockerfile, use_cache=use_cache,
+                                    skip_unchanged=skip_unchanged, target=target, cache=cache)
+    if skipped:
+        return name
     if retcode != 0:
         name = None
         fatal('build failed. See errors above.')
@@ -71,6 +205,139 @@ def build_image(name, context, build_args, dockerfile=None, use_cache=True):
     return name
 
 
+class BuildTask(object):
+    """one image of app.yaml builds"""
+
+    def __init__(self, name, image, context, dockerfile=None, build_args=None, use_cache=True,
+                 skip_unchanged=False, target=None, cache=None):
+        self.name = name
+        self.image = image
+        self.context = context
+        self.dockerfile = dockerfile
+        self.build_args = build_args
+        self.use_cache = use_cache
+        self.skip_unchanged = skip_unchanged
+        self.target = target
+        # see _build_command
+        self.cache = cache
+
+
+_FROM_RE = re.compile(r'^\s*FROM\s+(?:--\S+\s+)*(\S+)', re.IGNORECASE | re.MULTILINE)
+_COPY_FROM_RE = re.compile(r'--from=(\S+)', re.IGNORECASE)
+
+
+def _base_images(dockerfile):
+    """images a Dockerfile builds on, FROM and COPY --from"""
+    try:
+        with open(dockerfile) as f:
+            text = f.read()
+    except (OSError, IOError):
+        return set()
+    return set(_FROM_RE.findall(text)) | set(_COPY_FROM_RE.findall(text))
+
+
+def _build_deps(tasks):
+    """{task name: names of the tasks whose image its Dockerfile uses}"""
+    images = {}
+    for t in tasks:
+        images[t.image] = t.name
+        if t.image.endswith(':latest'):
+            images[t.image[:-len(':latest')]] = t.name
+    deps = {}
+    for t in tasks:
+        bases = _base_images(_dockerfile_path(t.context, t.dockerfile))
+        deps[t.name] = set(images[b] for b in bases if b in images) - {t.name}
+    return deps
+
+
+def build_images(tasks, parallel=1):
+    """build tasks, at most `parallel` at the same time.
+    a task starts once the builds its Dockerfile is based on succeeded. the
+    output lines are prefixed with the build name, the first failure
+    terminates the running builds and skips the pending ones, and a table
+    of the wall time of every build is printed at the end."""
+    if parallel <= 1:
+        for t in tasks:
+            build_image(t.image, t.context, t.build_args, dockerfile=t.dockerfile, use_cache=t.use_cache,
+                        skip_unchanged=t.skip_unchanged, target=t.target, cache=t.cache)
+        return
+
+    deps = _build_deps(tasks)
+    width = max(len(t.name) for t in tasks)
+    procs = set()
+    cancelled = threading.Event()
+    results = {}
+
+    def run(t):
+        if cancelled.is_set():
+            return 'cancelled', 0
+        start = time.time()
+        prefix = '[{}] '.format(t.name.ljust(width))
+        with _echo_lock:
+            click.echo(info('{}building image {} ...'.format(prefix, t.image)))
+        retcode, skipped = _build_image(t.image, t.context, t.build_args, dockerfile=t.dockerfile,
+                                        use_cache=t.use_cache, prefix=prefix, procs=procs,
+                                        skip_unchanged=t.skip_unchanged, target=t.target, cache=t.cache)
+        if retcode == 0:
+            return 'up to date' if skipped else 'ok', time.time() - start
+        return 'cancelled' if cancelled.is_set() else 'failed', time.time() - start
+
+    start = time.time()
+    pending = list(tasks)
+    running = {}
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        try:
+            while pending or running:
+                if not cancelled.is_set():
+                    for t in list(pending):
+                        if len(running) >= parallel:
+                            break
+                        if all(results.get(d, ('', ))[0] in ('ok', 'up to date') for d in deps[t.name]):
+                            pending.remove(t)
+                            running[executor.submit(run, t)] = t
+                if not running:
+                    # a dependency failed, or the tasks depend on each other
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    t = running.pop(future)
+                    results[t.name] = future.result()
+                    if results[t.name][0] == 'failed' and not cancelled.is_set():
+                        cancelled.set()
+                        for proc in list(procs):
+                            proc.terminate()
+        except KeyboardInterrupt:
+            cancelled.set()
+            for proc in list(procs):
+                proc.terminate()
+            raise
+
+    table = PrettyTable(['build', 'image', 'status', 'time'])
+    table.align['image'] = 'l'
+    for t in tasks:
+        status, elapsed = results.get(t.name, ('skipped', 0))
+        table.add_row([t.name, t.image, status, '{:.1f}s'.format(elapsed) if elapsed else '-'])
+    click.echo(table)
+
+    summary = '{} builds in {:.1f}s'.format(len(tasks), time.time() - start)
+    failed = [t.name for t in tasks if results.get(t.name, ('', ))[0] == 'failed']
+    if failed:
+        fatal('{}, failed: {}. See errors above.'.format(summary, ', '.join(failed)))
+    not_built = [t.name for t in tasks if t.name not in results]
+    if not_built:
+        fatal('{}, the Dockerfiles of {} are based on each other'.format(summary, ', '.join(not_built)))
+    click.echo(info(summary))
+
+
+def run_script(image, volumes, script, on_line, procs=None):
+    """run the sh script in a container of image, every output line is
+    passed to on_line, return the exit code"""
+    docker_args = ['run', '--rm', '--network', 'host', '--entrypoint', 'sh']
+    for volume in volumes:
+        docker_args.extend(['-v', volume])
+    return _docker(docker_args + [image, '-c', script], on_line=on_line, procs=procs)
+
+
 def run_container(image, volumes, cmd_list, name=None):
     if name is None:
         docker_args = [
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+read branch, HEAD commit, exact tag and remote url of a git repo.
+
+GitRepoInfo reads HEAD, refs, packed-refs and config under .git directly,
+so a command doesn't fork one git process per piece of information.
+whenever the reader meets something it doesn't understand (packed annotated
+tags, insteadOf rewrites, config includes...), it falls back to the git
+command, so the result is always the same as git's.
+"""
+from __future__ import print_function, division, absolute_import
+import os
+import re
+import zlib
+import subprocess
+from os import getenv
+
+_GITLAB_CI_REMOTE_URL_PATTERN = re.compile(r'http://gitlab-ci-token:(.+)@([\.\w]+)/([-\w]+)/([-/\w]+).git')
+_SECTION_PATTERN = re.compile(r'^\s*\[\s*([-\w.]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\]\s*$')
+_KEY_VALUE_PATTERN = re.compile(r'^\s*([-\w]+)\s*=\s*(.*?)\s*$')
+
+# the reader can't answer, ask git
+_UNKNOWN = object()
+
+
+class GitError(Exception):
+    pass
+
+
+def _run_git(args, cwd):
+    try:
+        p = subprocess.run(['git'] + args, cwd=cwd, stdout=subprocess.PIPE,
+                           stderr=subprocess.PIPE, universal_newlines=True)
+    except OSError:
+        raise GitError('git executable not found')
+    if p.returncode:
+        raise GitError(p.stderr.strip())
+    return p.stdout.strip()
+
+
+def _read_text(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except (OSError, IOError):
+        return None
+
+
+def find_git_dir(path):
+    """return (git_dir, common_dir) of the repo containing path,
+    common_dir differs from git_dir in a linked worktree."""
+    if getenv('GIT_DIR'):
+        return None, None
+    path = os.path.abspath(path)
+    while True:
+        dotgit = os.path.join(path, '.git')
+        if os.path.isdir(dotgit):
+            git_dir = dotgit
+            break
+        if os.path.isfile(dotgit):
+            content = (_read_text(dotgit) or '').strip()
+            if not content.startswith('gitdir:'):
+                return None, None
+            git_dir = os.path.normpath(os.path.join(path, content[len('gitdir:'):].strip()))
+            break
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None, None
+        path = parent
+
+    common_dir = git_dir
+    commondir = _read_text(os.path.join(git_dir, 'commondir'))
+    if commondir:
+        common_dir = os.path.normpath(os.path.join(git_dir, commondir.strip()))
+    return git_dir, common_dir
+
+
+class GitRepoInfo(object):
+    """git metadata of the repo at cwd, every piece is read at most once"""
+
+    def __init__(self, cwd=None):
+        self.cwd = os.path.abspath(cwd or os.getcwd())
+        self.git_dir, self.common_dir = find_git_dir(self.cwd)
+        self._cache = {}
+
+    def _cached(self, key, func):
+        if key not in self._cache:
+            try:
+                self._cache[key] = (func(), None)
+            except GitError as e:
+                self._cache[key] = (None, e)
+        value, err = self._cache[key]
+        if err is not None:
+            raise err
+        return value
+
+    @property
+    def branch(self):
+        """inside gitlab-ci, repo is at detached state, so you cannot get branch
+        name from the current git repo, but luckily there's a environment
+        variable called CI_BUILD_REF_NAME"""
+        branch = self._cached('branch', self._read_branch)
+        if branch == 'HEAD':
+            branch = getenv('CI_BUILD_REF_NAME', '')
+        return branch
+
+    @property
+    def commit_hash(self):
+        return self._cached('commit_hash', self._read_commit_hash)
+
+    @property
+    def tag(self):
+        """the tag exactly matching HEAD, like `git describe --exact-match --tags`"""
+        return self._cached('tag', self._read_tag)
+
+    def remote_url(self, remote='origin'):
+        url = self._cached('remote_url:' + remote, lambda: self._read_remote_url(remote))
+
+        # 对gitlab ci需要特殊处理一下
+        # 丫有个特殊的格式, 不太好支持...
+        match = _GITLAB_CI_REMOTE_URL_PATTERN.match(url)
+        if match:
+            host = match.group(2)
+            group = match.group(3)
+            project = match.group(4)
+            return 'git@{host}:{group}/{project}.git'.format(host=host, group=group, project=project)
+        return url
+
+    # ---------- HEAD and refs ----------
+
+    def _head(self):
+        """return (ref name or None if detached, sha or _UNKNOWN)"""
+        if 'head' not in self._cache:
+            head = (None, _UNKNOWN)
+            content = _read_text(os.path.join(self.git_dir, 'HEAD')) if self.git_dir else None
+            if content is not None:
+                content = content.strip()
+                if content.startswith('ref:'):
+                    ref = content[len('ref:'):].strip()
+                    head = (ref, self._resolve_ref(ref))
+                elif re.match(r'^[0-9a-f]{40}$', content):
+                    head = (None, content)
+            self._cache['head'] = head
+        return self._cache['head']
+
+    def _packed_refs(self):
+        """return (refs, peeled), peeled is _UNKNOWN when packed-refs
+        doesn't record the peeled value of every annotated tag"""
+        if 'packed_refs' not in self._cache:
+            refs, peeled = {}, {}
+            content = _read_text(os.path.join(self.common_dir, 'packed-refs'))
+            if content is not None:
+                lines = content.splitlines()
+                if not (lines and lines[0].startswith('#') and 'fully-peeled' in lines[0]):
+                    peeled = _UNKNOWN
+                last = None
+                for line in lines:
+                    if not line or line.startswith('#'):
+                        continue
+                    if line.startswith('^'):
+                        if last is not None and peeled is not _UNKNOWN:
+                            peeled[last] = line[1:].strip()
+                        continue
+                    sha, _, name = line.partition(' ')
+                    refs[name.strip()] = sha
+                    last = name.strip()
+            self._cache['packed_refs'] = (refs, peeled)
+        return self._cache['packed_refs']
+
+    def _resolve_ref(self, ref, depth=0):
+        if depth > 5:
+            return _UNKNOWN
+        # loose refs take precedence over packed refs
+        content = _read_text(os.path.join(self.common_dir, ref))
+        if content is not None:
+            content = content.strip()
+            if content.startswith('ref:'):
+                return self._resolve_ref(content[len('ref:'):].strip(), depth + 1)
+            return content
+        refs, _ = self._packed_refs()
+        # unborn branch or something unusual, let git report it
+        return refs.get(ref, _UNKNOWN)
+
+    def _loose_tags(self):
+        tags = {}
+        tags_dir = os.path.join(self.common_dir, 'refs', 'tags')
+        for root, _, files in os.walk(tags_dir):
+            for fname in files:
+                path = os.path.join(root, fname)
+                name = os.path.relpath(path, self.common_dir).replace(os.sep, '/')
+                content = (_read_text(path) or '').strip()
+                tags[name] = content if re.match(r'^[0-9a-f]{40}$', content) else _UNKNOWN
+        return tags
+
+    def _peel(self, sha, depth=0):
+        """follow annotated tag objects down to the commit, only loose objects are supported"""
+        if depth > 5:
+            return _UNKNOWN
+        path = os.path.join(self.common_dir, 'objects', sha[:2], sha[2:])
+        try:
+            with open(path, 'rb') as f:
+                # the header and the first line are enough
+                data = zlib.decompressobj().decompress(f.read(), 512)
+        except (OSError, IOError, zlib.error):
+            return _UNKNOWN
+        header, _, body = data.partition(b'\0')
+        if not header.startswith(b'tag '):
+            return sha
+        first_line = body.split(b'\n', 1)[0]
+        if not first_line.startswith(b'object '):
+            return _UNKNOWN
+        return self._peel(first_line[len(b'object '):].decode('ascii').strip(), depth + 1)
+
+    # ---------- readers ----------
+
+    def _read_branch(self):
+        if self.git_dir:
+            ref, _ = self._head()
+            if ref is None and self._head()[1] is not _UNKNOWN:
+                return 'HEAD'
+            if ref is not None and ref.startswith('refs/heads/'):
+                return ref[len('refs/heads/'):]
+        return _run_git(['rev-parse', '--abbrev-ref', 'HEAD'], self.cwd)
+
+    def _read_commit_hash(self):
+        if self.git_dir:
+            _, sha = self._head()
+            if sha is not _UNKNOWN:
+                return sha
+        return _run_git(['rev-parse', 'HEAD'], self.cwd)
+
+    def _read_tag(self):
+        if self.git_dir:
+            tags = self._tags_at_head()
+            if tags is not _UNKNOWN:
+                if len(tags) == 1:
+                    return tags[0]
+                if not tags:
+                    raise GitError("fatal: no tag exactly matches '{}'".format(self.commit_hash))
+            # more than one tag, let git choose the same one as before
+        return _run_git(['describe', '--exact-match', '--abbrev=0', '--tags'], self.cwd)
+
+    def _tags_at_head(self):
+        _, head = self._head()
+        if head is _UNKNOWN:
+            return _UNKNOWN
+        packed, peeled = self._packed_refs()
+        loose = self._loose_tags()
+
+        matched = []
+        for name in set(packed) | set(loose):
+            if not name.startswith('refs/tags/'):
+                continue
+            if name in loose:
+                sha = loose[name]
+                if sha is _UNKNOWN:
+                    return _UNKNOWN
+                target = sha if sha == head else self._peel(sha)
+            else:
+                if peeled is _UNKNOWN:
+                    return _UNKNOWN
+                target = peeled.get(name, packed[name])
+            if target is _UNKNOWN:
+                return _UNKNOWN
+            if target == head:
+                matched.append(name[len('refs/tags/'):])
+        return matched
+
+    def _remotes(self):
+        """return {remote name: url} from .git/config, or _UNKNOWN if the url may be rewritten"""
+        if 'remotes' not in self._cache:
+            self._cache['remotes'] = self._parse_remotes()
+        return self._cache['remotes']
+
+    def _parse_remotes(self):
+        content = _read_text(os.path.join(self.common_dir, 'config'))
+        if content is None:
+            return _UNKNOWN
+        # url rewrites may also come from the global config
+        for path in ('~/.gitconfig', '~/.config/git/config'):
+            global_content = _read_text(os.path.expanduser(path)) or ''
+            if 'insteadof' in global_content.lower():
+                return _UNKNOWN
+
+        remotes = {}
+        section = subsection = None
+        for line in content.splitlines():
+            line = line.strip()
+            if not line or line[0] in '#;':
+                continue
+            m = _SECTION_PATTERN.match(line)
+            if m:
+                section, subsection = m.group(1).lower(), m.group(2)
+                if section in ('include', 'includeif'):
+                    return _UNKNOWN
+                continue
+            if line.startswith('['):
+                # section syntax this reader doesn't support
+                return _UNKNOWN
+            m = _KEY_VALUE_PATTERN.match(line)
+            if not m:
+                continue
+            key, value = m.group(1).lower(), m.group(2)
+            if key in ('insteadof', 'pushinsteadof'):
+                return _UNKNOWN
+            if section == 'remote' and key == 'url' and subsection not in remotes:
+                if len(value) >= 2 and value[0] == value[-1] == '"':
+                    value = value[1:-1]
+                remotes[subsection] = value
+        return remotes
+
+    def _read_remote_url(self, remote):
+        if self.git_dir:
+            remotes = self._remotes()
+            if remotes is not _UNKNOWN:
+                if remote not in remotes:
+                    raise GitError("error: No such remote '{}'".format(remote))
+                return remotes[remote]
+        return _run_git(['remote', 'get-url', str(remote)], self.cwd)
+
+
+_repo_infos = {}
+
+
+def get_git_repo_info(cwd=None):
+    """GitRepoInfo is shared by all callers of the same invocation"""
+    cwd = os.path.abspath(cwd or os.getcwd())
+    if cwd not in _repo_infos:
+        _repo_infos[cwd] = GitRepoInfo(cwd)
+    return _repo_infos[cwd]
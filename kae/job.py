@@ -13,6 +13,7 @@ from kae.utils import (
     get_current_branch, get_remote_url, get_git_tag,
     get_specs_text, error, info, fatal, handle_console_err
 )
+from kae.output import output_option, get_output_format, echo_data, wide_columns
 
 
 @click.argument('jobname', required=False)
@@ -32,20 +33,22 @@ def create_job(ctx, jobname, git, f, literal):
     click.echo(info('Create job done.'))
 
 
-@click.option('--raw', default=False, is_flag=True, help='print the raw json')
+@output_option
 @click.pass_context
-def list_job(ctx, raw):
+def list_job(ctx, output, raw):
     kae = ctx.obj['kae_api']
     with handle_console_err():
         jobs = kae.list_job()
 
-    if raw:
-        click.echo(str(jobs))
-    else:
-        table = PrettyTable(['name', 'status', 'user', 'created'])
+    def table(wide=False):
+        columns = ['name', 'status', 'user', 'created']
+        extra = wide_columns(columns, jobs, skip=('nickname', 'specs_text'))[4:] if wide else []
+        t = PrettyTable(columns + extra)
         for r in jobs:
-            table.add_row([r['name'], r['status'], r['nickname'], r['created']])
-        click.echo(table)
+            t.add_row([r['name'], r['status'], r['nickname'], r['created']] + [r.get(c) for c in extra])
+        return t
+
+    echo_data(jobs, get_output_format(output, raw), table, lambda: table(wide=True))
 
 
 @click.argument('jobname', required=True)
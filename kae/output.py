@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+output formats of the read commands.
+
+table and wide are for humans, json, ndjson and yaml print the data returned
+by the console as it is, so scripts never need to scrape a table.
+"""
+from __future__ import print_function, division, absolute_import
+import json
+
+import click
+import yaml
+
+OUTPUT_FORMATS = ('table', 'wide', 'json', 'ndjson', 'yaml')
+
+
+def output_option(f):
+    """-o/--output of a read command, the global `kae -o` is the default"""
+    f = click.option('--raw', default=False, is_flag=True, help='same as `-o json`')(f)
+    return click.option('-o', '--output', type=click.Choice(OUTPUT_FORMATS),
+                        help='output format, default to `kae -o` or table')(f)
+
+
+def get_output_format(output=None, raw=False):
+    if raw:
+        return 'json'
+    if output:
+        return output
+    ctx = click.get_current_context(silent=True)
+    obj = ctx.obj if ctx is not None else None
+    return (obj or {}).get('output') or 'table'
+
+
+def wide_columns(columns, items, skip=()):
+    """columns followed by the other scalar fields of items, for `-o wide`"""
+    extra = set()
+    for item in items:
+        extra.update(k for k, v in item.items() if not isinstance(v, (dict, list)))
+    return list(columns) + sorted(extra - set(columns) - set(skip))
+
+
+def to_json(data, indent=None):
+    return json.dumps(data, indent=indent, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def echo_data(data, fmt, table=None, wide=None, items=None):
+    """print data in fmt.
+    table and wide are functions returning the text of the table, wide falls
+    back to table. ndjson prints every element of items(default to data if
+    it's a list) on its own line as soon as it's serialized, items can be
+    any iterable, so callers may pass a generator to stream."""
+    if fmt == 'json':
+        click.echo(to_json(data, indent=2))
+    elif fmt == 'ndjson':
+        if items is None:
+            items = data if isinstance(data, list) else [data]
+        for item in items:
+            click.echo(to_json(item))
+    elif fmt == 'yaml':
+        click.echo(yaml.safe_dump(data, default_flow_style=False, allow_unicode=True), nl=False)
+    elif fmt == 'wide' and wide is not None:
+        click.echo(wide())
+    else:
+        click.echo(table())
@@ -0,0 +1,693 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+live pod table of `--watch` and `app:watch_pods`.
+
+PodWatcher resumes the pod event stream after the connection drops, every
+watch event only recomputes the row of the pod it carries, frames are
+coalesced to at most `fps` per second and only the changed lines of the
+terminal are rewritten. when stdout isn't a tty(e.g. CI logs), one line is
+printed per pod state transition instead.
+"""
+from __future__ import print_function, division, absolute_import
+import re
+import sys
+import math
+import json
+import time
+import queue
+import random
+import shutil
+import threading
+from collections import OrderedDict
+from urllib.parse import urljoin
+
+import click
+
+from kae.utils import error, info, handle_console_err
+
+POD_COLUMNS = ['name', 'status', 'ready', 'restarts', 'ip', 'node']
+
+# reconnect delays of PodWatcher, full jitter over an exponential backoff
+_WATCH_BACKOFF_BASE = 0.5
+_WATCH_BACKOFF_MAX = 30
+_WATCH_MAX_RETRIES = 10
+# events buffered between the watcher threads and the table
+_WATCH_QUEUE_SIZE = 1000
+
+# seconds between deployment polls while the pods look ready but the
+# rollout isn't finished, pod events don't tell when it is
+_ROLLOUT_POLL_INTERVAL = 2
+
+# exit codes of `app:wait` and `--wait-timeout`, 124 like timeout(1)
+WAIT_FAILED_EXIT_CODE = 3
+WAIT_TIMEOUT_EXIT_CODE = 124
+# container waiting reasons which won't get better by waiting
+POD_FAILURE_REASONS = (
+    'CrashLoopBackOff', 'ImagePullBackOff', 'ErrImagePull', 'InvalidImageName', 'CreateContainerConfigError',
+)
+
+
+class _WatchExpired(Exception):
+    """the console no longer has the resource version we want to resume from"""
+
+
+class PodWatcher(object):
+    """pod events of an app, reconnecting when the connection drops.
+
+    the resource version of the last event is sent when reconnecting so
+    the console only replays what was missed. pods are listed again only
+    when the console says that version is too old(410 Gone), the events
+    of the new list replace what was seen before."""
+
+    def __init__(self, kae, appname, canary=False, max_retries=_WATCH_MAX_RETRIES):
+        self.kae = kae
+        self.appname = appname
+        self.canary = canary
+        self.max_retries = max_retries
+        self.resource_version = None
+        self.reconnects = 0
+        self.relists = 0
+        # names of the pods seen so far, to find the ones deleted while relisting
+        self.known = set()
+        self.ws = None
+        self._closed = threading.Event()
+
+    def _connect(self):
+        """KaeAPI.request_ws, but the socket is kept in self.ws so close() can
+        interrupt a recv blocked in another thread"""
+        import websocket
+        from kaelib import KaeAPIError
+        from kaelib.api import recv
+
+        payload = {
+            'cluster': self.kae.cluster,
+            'canary': self.canary,
+        }
+        if self.resource_version:
+            payload['resource_version'] = self.resource_version
+        url = re.sub(r'^http', 'ws', urljoin(self.kae.base, 'ws/app/%s/pods/events' % self.appname))
+        headers = {'Authorization': self.kae.session.headers['Authorization']}
+        if 'X-Real-User' in self.kae.session.headers:
+            headers['X-Real-User'] = self.kae.session.headers['X-Real-User']
+
+        self.ws = websocket.create_connection(url, header=headers)
+        try:
+            if self._closed.is_set():
+                return
+            self.ws.send(json.dumps(payload))
+            while True:
+                opcode, msg = recv(self.ws)
+                if opcode == websocket.ABNF.OPCODE_CLOSE:
+                    return
+                if opcode not in (websocket.ABNF.OPCODE_TEXT, websocket.ABNF.OPCODE_BINARY):
+                    continue
+                try:
+                    yield json.loads(msg)
+                except (ValueError, TypeError):
+                    raise KaeAPIError(500, 'json decode error {}'.format(msg))
+        finally:
+            self.ws.close()
+
+    def close(self):
+        """stop reconnecting and drop the current connection"""
+        self._closed.set()
+        ws = self.ws
+        if ws is not None:
+            # abort wakes up the thread blocked in recv
+            ws.abort()
+
+    def _relist(self):
+        pods = self.kae.get_app_pods(self.appname, canary=self.canary)
+        self.relists += 1
+        self.resource_version = (pods.get('metadata') or {}).get('resource_version')
+        events = []
+        names = set()
+        for pod in pods['items']:
+            names.add(pod['metadata']['name'])
+            events.append({'action': 'MODIFIED', 'object': pod})
+        for name in self.known - names:
+            events.append({'action': 'DELETED', 'object': {'metadata': {'name': name}}})
+        self.known = names
+        return events
+
+    def _track(self, m):
+        metadata = m['object']['metadata']
+        if m['action'] == 'DELETED':
+            self.known.discard(metadata['name'])
+        else:
+            self.known.add(metadata['name'])
+        self.resource_version = metadata.get('resource_version') or self.resource_version
+
+    @staticmethod
+    def _check_error_event(m):
+        from kaelib import KaeAPIError
+
+        if m.get('action') != 'ERROR':
+            return
+        status = m.get('object') or {}
+        if status.get('code') == 410:
+            raise _WatchExpired()
+        raise KaeAPIError(status.get('code') or 500, status.get('message') or str(status))
+
+    def __iter__(self):
+        import websocket
+        from kaelib import KaeAPIError
+
+        failures = 0
+        relist = False
+        while not self._closed.is_set():
+            got_event = False
+            err = None
+            try:
+                if relist:
+                    events = self._relist()
+                    relist = False
+                    for m in events:
+                        yield m
+                for m in self._connect():
+                    self._check_error_event(m)
+                    got_event = True
+                    self._track(m)
+                    yield m
+            except _WatchExpired:
+                relist = True
+                continue
+            except KaeAPIError as e:
+                if e.http_code == 410:
+                    relist = True
+                    continue
+                if e.http_code < 500:
+                    raise
+                err = e
+            except websocket.WebSocketBadStatusException as e:
+                if e.status_code == 410:
+                    relist = True
+                    continue
+                if e.status_code < 500:
+                    raise KaeAPIError(e.status_code, str(e))
+                err = e
+            except (websocket.WebSocketException, OSError) as e:
+                err = e
+
+            if self._closed.is_set():
+                return
+            # the connection dropped or the console closed it
+            failures = 1 if got_event else failures + 1
+            if failures > self.max_retries:
+                if isinstance(err, KaeAPIError):
+                    raise err
+                raise KaeAPIError(500, 'watch pods of {} failed: {}'.format(
+                    self.appname, str(err) if err else 'connection closed'))
+            delay = min(_WATCH_BACKOFF_MAX, _WATCH_BACKOFF_BASE * 2 ** (failures - 1))
+            if self._closed.wait(random.uniform(0, delay)):
+                return
+            self.reconnects += 1
+
+
+class PodRecord(object):
+    """the fields of a pod the table needs, updated in place from watch events
+    so the raw pod json isn't kept around"""
+    __slots__ = ('name', 'status', 'ready_count', 'ready_total', 'restarts', 'ip', 'node', 'transitioned_at')
+
+    def __init__(self, name):
+        self.name = name
+        self.status = None
+        self.ready_count = 0
+        self.ready_total = 0
+        self.restarts = 0
+        self.ip = None
+        self.node = None
+        self.transitioned_at = None
+
+    @property
+    def ready(self):
+        return "{}/{}".format(self.ready_count, self.ready_total)
+
+    @property
+    def is_ready(self):
+        return self.ready_count == self.ready_total
+
+    def state(self):
+        return self.status, self.ready_count, self.ready_total, self.restarts
+
+    def update(self, pod):
+        """return True if status, ready or restarts changed"""
+        old = self.state()
+        status = pod['status']['phase']
+        restart_count = 0
+        ready_count = 0
+        c_status_list = pod['status'].get('container_statuses', None)
+        if c_status_list:
+            for cont_status in c_status_list:
+                if cont_status['ready']:
+                    ready_count += 1
+                else:
+                    if cont_status['state'].get('terminated', None):
+                        status = cont_status['state']['terminated']['reason']
+                    elif cont_status['state'].get('waiting', None):
+                        status = cont_status['state']['waiting']['reason']
+            if cont_status['restart_count'] > restart_count:
+                restart_count = cont_status['restart_count']
+        self.status = status
+        self.ready_count = ready_count
+        self.ready_total = len(pod['spec']['containers'])
+        self.restarts = restart_count
+        self.ip = pod['status'].get('pod_ip', None)
+        self.node = pod['status'].get('host_ip', None)
+        if self.state() != old:
+            self.transitioned_at = time.time()
+            return True
+        return False
+
+
+def rollout_complete(deployment):
+    """the check of `kubectl rollout status`: the controller has seen the
+    latest spec, every replica runs it and is available, no old pod is left.
+    a deployment without status is taken as rolled out, there's nothing else
+    to go by"""
+    status = deployment.get('status')
+    if not status:
+        return True
+    generation = (deployment.get('metadata') or {}).get('generation') or 0
+    if (status.get('observed_generation') or 0) < generation:
+        return False
+    updated = status.get('updated_replicas') or 0
+    return (updated == deployment['spec']['replicas'] and (status.get('replicas') or 0) == updated and
+            (status.get('available_replicas') or 0) == updated)
+
+
+def format_table(header, rows):
+    """lines of a table looking like PrettyTable's"""
+    widths = [len(h) for h in header]
+    for row in rows:
+        for i, cell in enumerate(row):
+            if len(cell) > widths[i]:
+                widths[i] = len(cell)
+    sep = '+' + '+'.join('-' * (w + 2) for w in widths) + '+'
+
+    def fmt(row):
+        return '| ' + ' | '.join(cell.ljust(w) for cell, w in zip(row, widths)) + ' |'
+
+    return [sep, fmt(header), sep] + [fmt(row) for row in rows] + [sep]
+
+
+class PodTable(object):
+    """derived rows of the watched pods, keyed by (cluster, pod name)"""
+
+    def __init__(self, replicas, show_cluster=False):
+        # {cluster: desired replicas}
+        self.replicas = replicas
+        self.show_cluster = show_cluster
+        self.rows = OrderedDict()
+        self.ready_pods = {cluster: 0 for cluster in replicas}
+        self.total_pods = {cluster: 0 for cluster in replicas}
+        self.start = time.time()
+        self.ready_at = {cluster: None for cluster in replicas}
+        self.states = {cluster: 'watching' for cluster in replicas}
+        # the pods of an old release are ready too until they're replaced,
+        # so the deployment has to say the rollout is done, see set_deployment
+        self.rolled_out = {cluster: False for cluster in replicas}
+        # (cluster, pod name, reason) of the failing pods found with fail_fast
+        self.failures = []
+        self.timed_out = False
+
+    def apply(self, cluster, event):
+        """update the record of the pod in event, return (state before the
+        event or None if the pod is new, the record or None if deleted)"""
+        pod = event['object']
+        name = pod['metadata']['name']
+        key = (cluster, name)
+        record = self.rows.get(key)
+        old = record.state() if record is not None else None
+        was_ready = record is not None and record.is_ready
+
+        if event['action'] == 'DELETED':
+            if record is not None:
+                del self.rows[key]
+                self.total_pods[cluster] -= 1
+            record = None
+        else:
+            if record is None:
+                record = self.rows[key] = PodRecord(name)
+                self.total_pods[cluster] += 1
+            record.update(pod)
+
+        self.ready_pods[cluster] += (record is not None and record.is_ready) - was_ready
+        self._check_ready(cluster)
+        return old, record
+
+    def set_deployment(self, cluster, deployment):
+        self.replicas[cluster] = deployment['spec']['replicas']
+        self.rolled_out[cluster] = rollout_complete(deployment)
+        self._check_ready(cluster)
+
+    def _check_ready(self, cluster):
+        if self.ready_at[cluster] is None and self.is_ready(cluster):
+            self.ready_at[cluster] = time.time() - self.start
+
+    def pods_ready(self, cluster):
+        replicas = self.replicas[cluster]
+        return self.ready_pods[cluster] == replicas and self.total_pods[cluster] == replicas
+
+    def is_ready(self, cluster):
+        return self.rolled_out[cluster] and self.pods_ready(cluster)
+
+    def lines(self):
+        header = (['cluster'] if self.show_cluster else []) + POD_COLUMNS
+        rows = []
+        items = sorted(self.rows.items()) if self.show_cluster else self.rows.items()
+        for (cluster, name), r in items:
+            row = [name, r.status, r.ready, r.restarts, r.ip, r.node]
+            rows.append([str(c) for c in ([cluster] if self.show_cluster else []) + row])
+        lines = format_table(header, rows)
+
+        if self.show_cluster:
+            summary = []
+            for cluster in sorted(self.replicas):
+                state = self.states[cluster]
+                if self.ready_at[cluster] is not None:
+                    state = 'ready in {:.1f}s'.format(self.ready_at[cluster])
+                summary.append([cluster, '{}/{}'.format(self.ready_pods[cluster], self.replicas[cluster]), state])
+            lines += format_table(['cluster', 'ready', 'state'], summary)
+        return lines
+
+
+class LiveRenderer(object):
+    """draw a list of lines in place on a terminal, rewriting only the
+    lines which changed since the previous frame"""
+
+    def __init__(self, stream=None, fps=10):
+        self.stream = stream or sys.stdout
+        self.interval = 1.0 / fps if fps > 0 else 0
+        self.drawn = []
+        self.last_draw = 0
+
+    def time_to_next_frame(self):
+        return max(self.last_draw + self.interval - time.time(), 0)
+
+    def draw(self, lines):
+        width = shutil.get_terminal_size().columns
+        # a wrapped line would break the cursor arithmetic below
+        lines = [line[:width - 1] for line in lines]
+        out = []
+        height = len(self.drawn)
+        for i, line in enumerate(lines[:height]):
+            if line != self.drawn[i]:
+                up = height - i
+                out.append('\x1b[{}A\r{}\x1b[K\x1b[{}B\r'.format(up, line, up))
+        for i in range(len(lines), height):
+            # the table shrank, blank the leftover lines
+            if self.drawn[i]:
+                up = height - i
+                out.append('\x1b[{}A\r\x1b[K\x1b[{}B\r'.format(up, up))
+        for line in lines[height:]:
+            out.append(line + '\n')
+        self.stream.write(''.join(out))
+        self.stream.flush()
+        self.drawn = lines + [''] * (height - len(lines))
+        self.last_draw = time.time()
+
+
+def log_transition(cluster, name, old, record, show_cluster=False):
+    """one line per pod state transition, for non tty output"""
+    if show_cluster:
+        name = '{}/{}'.format(cluster, name)
+    when = time.time()
+    if record is None:
+        change = 'deleted'
+    else:
+        if old == record.state():
+            return
+        when = record.transitioned_at
+        change = '{} -> {}'.format(old[0], record.status) if old else 'added, {}'.format(record.status)
+        change += ' ready {} restarts {}'.format(record.ready, record.restarts)
+    click.echo('[{}] {} {}'.format(time.strftime('%H:%M:%S', time.localtime(when)), name, change))
+
+
+ROLLOUT_STAGES = ('Pending', 'ContainerCreating', 'Running', 'Ready')
+
+
+def _percentile(values, p):
+    """nearest rank percentile of sorted values"""
+    if not values:
+        return None
+    return values[max(int(math.ceil(p / 100.0 * len(values))) - 1, 0)]
+
+
+class RolloutReport(object):
+    """when each new pod reached Pending, ContainerCreating, Running and Ready.
+
+    pods already ready when first seen belong to the previous rollout and
+    are left out of the startup latency."""
+
+    def __init__(self, appname):
+        self.appname = appname
+        self.start = time.time()
+        # {cluster: {pod name: {stage: seconds since start}}}
+        self.pods = {}
+        self.ready_at = {}
+
+    @staticmethod
+    def _stage(record):
+        if record.is_ready and record.status == 'Running':
+            return 'Ready'
+        if record.status in ROLLOUT_STAGES:
+            return record.status
+        return None
+
+    def observe(self, cluster, name, old, record):
+        if record is None:
+            return
+        pods = self.pods.setdefault(cluster, {})
+        stage = self._stage(record)
+        if name not in pods:
+            if old is None and stage == 'Ready':
+                pods[name] = None
+                return
+            pods[name] = {'seen': record.transitioned_at - self.start}
+        stages = pods[name]
+        if stages is not None and stage is not None and stage not in stages:
+            stages[stage] = record.transitioned_at - self.start
+
+    def summary(self, cluster):
+        pods = {name: stages for name, stages in self.pods.get(cluster, {}).items() if stages is not None}
+        ready = sorted(stages['Ready'] for stages in pods.values() if 'Ready' in stages)
+        latencies = sorted(stages['Ready'] - stages['seen'] for stages in pods.values() if 'Ready' in stages)
+        return {
+            'new_pods': len(pods),
+            'ready_pods': len(ready),
+            'first_ready': ready[0] if ready else None,
+            'all_ready': self.ready_at.get(cluster),
+            'p50': _percentile(latencies, 50),
+            'p95': _percentile(latencies, 95),
+            'max': latencies[-1] if latencies else None,
+            'pods': pods,
+        }
+
+    def show(self):
+        from prettytable import PrettyTable
+
+        def fmt(seconds):
+            return '-' if seconds is None else '{:.1f}s'.format(seconds)
+
+        table = PrettyTable(['cluster', 'new pods', 'first ready', 'all ready', 'p50', 'p95', 'max'])
+        for cluster in sorted(self.ready_at):
+            data = self.summary(cluster)
+            table.add_row([cluster, '{}/{}'.format(data['ready_pods'], data['new_pods']), fmt(data['first_ready']),
+                           fmt(data['all_ready']), fmt(data['p50']), fmt(data['p95']), fmt(data['max'])])
+        click.echo(table)
+
+    def write_json(self, path):
+        data = {
+            'app': self.appname,
+            'started_at': self.start,
+            'clusters': {cluster: self.summary(cluster) for cluster in self.ready_at},
+        }
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+
+
+def _merge_watchers(targets, stop):
+    """consume every watcher in its own thread, yield (cluster, event) from
+    one queue, event is None when the watcher ends or the exception it raised.
+    the threads return once stop is set"""
+    events = queue.Queue(maxsize=_WATCH_QUEUE_SIZE)
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                events.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def consume(cluster, watcher):
+        try:
+            for m in watcher:
+                if not put((cluster, m)):
+                    return
+        except Exception as e:
+            if stop.is_set() or not put((cluster, e)):
+                return
+        put((cluster, None))
+
+    for cluster, (_, watcher) in targets.items():
+        t = threading.Thread(target=consume, args=(cluster, watcher))
+        t.daemon = True
+        t.start()
+    return events
+
+
+def _run_watch(targets, appname, canary=False, forever=False, fps=10, report=None,
+               quiet=False, timeout=None, fail_fast=False):
+    """consume pod events of every cluster in targets({cluster: (kae, watcher)})
+    until all pods are ready, or until the watchers end when forever is True.
+    quiet: don't render the table nor log transitions
+    timeout: stop after that many seconds, table.timed_out is set
+    fail_fast: stop as soon as a pod is in POD_FAILURE_REASONS, see table.failures
+    return the PodTable"""
+    deployments = {}
+    for cluster, (kae, _) in targets.items():
+        with handle_console_err():
+            deployments[cluster] = kae.get_app_deployment(appname, canary)
+
+    show_cluster = len(targets) > 1
+    table = PodTable({c: d['spec']['replicas'] for c, d in deployments.items()}, show_cluster=show_cluster)
+    for cluster, deployment in deployments.items():
+        table.set_deployment(cluster, deployment)
+    if report is not None:
+        table.start = report.start
+        report.ready_at = table.ready_at
+    deadline = table.start + timeout if timeout else None
+    renderer = LiveRenderer(fps=fps) if not quiet and sys.stdout.isatty() else None
+    if renderer:
+        renderer.draw(table.lines())
+
+    def done():
+        return (not forever and all(table.is_ready(c) for c in active)) or table.failures
+
+    errors = []
+    active = set(targets)
+    if done():
+        return table
+
+    next_poll = {cluster: time.time() + _ROLLOUT_POLL_INTERVAL for cluster in targets}
+
+    def rollout_pending():
+        """clusters whose pods look ready, but not the deployment yet"""
+        return [c for c in active if table.pods_ready(c) and not table.rolled_out[c]]
+
+    def poll_rollout():
+        for cluster in rollout_pending():
+            if time.time() < next_poll[cluster]:
+                continue
+            next_poll[cluster] = time.time() + _ROLLOUT_POLL_INTERVAL
+            try:
+                table.set_deployment(cluster, targets[cluster][0].get_app_deployment(appname, canary))
+            except Exception:
+                # try again on the next poll, --timeout bounds it
+                continue
+
+    stop = threading.Event()
+    events = _merge_watchers(targets, stop)
+    dirty = False
+    try:
+        while active and not done():
+            waits = []
+            if renderer and dirty:
+                waits.append(renderer.time_to_next_frame())
+            if deadline is not None:
+                waits.append(max(deadline - time.time(), 0))
+            pending = rollout_pending()
+            if pending:
+                waits.append(max(min(next_poll[c] for c in pending) - time.time(), 0))
+            try:
+                cluster, m = events.get(timeout=min(waits) if waits else None)
+            except queue.Empty:
+                if deadline is not None and time.time() >= deadline:
+                    table.timed_out = True
+                    break
+                poll_rollout()
+                if renderer and dirty:
+                    renderer.draw(table.lines())
+                    dirty = False
+                continue
+
+            if m is None:
+                active.discard(cluster)
+                if table.ready_at[cluster] is None:
+                    table.states[cluster] = 'watch closed'
+            elif isinstance(m, Exception):
+                table.states[cluster] = 'watch error: {}'.format(str(m))
+                errors.append(m)
+            else:
+                old, record = table.apply(cluster, m)
+                name = m['object']['metadata']['name']
+                if report is not None:
+                    report.observe(cluster, name, old, record)
+                if fail_fast and record is not None and record.status in POD_FAILURE_REASONS:
+                    table.failures.append((cluster, name, record.status))
+                if renderer is None and not quiet:
+                    log_transition(cluster, name, old, record, show_cluster)
+            dirty = True
+            if renderer and renderer.time_to_next_frame() == 0:
+                renderer.draw(table.lines())
+                dirty = False
+    finally:
+        stop.set()
+        for _, watcher in targets.values():
+            watcher.close()
+
+    if renderer and dirty:
+        renderer.draw(table.lines())
+    if errors and not show_cluster:
+        raise errors[0]
+    return table
+
+
+def watch_pods(targets, appname, canary=False, forever=False, fps=10, report=None):
+    """watch pods of every cluster in targets({cluster: (kae, watcher)}) until
+    all of them are ready, or until the watchers end when forever is True.
+    every pod transition is fed to report(a RolloutReport) if given.
+    return {cluster: seconds until all pods were ready, None if never}"""
+    return _run_watch(targets, appname, canary=canary, forever=forever, fps=fps, report=report).ready_at
+
+
+def wait_pods(targets, appname, canary=False, timeout=None, watch=False, report=None):
+    """wait until all pods of every cluster in targets are ready, the table is
+    only rendered when watch is True.
+    return (exit code, {cluster: seconds until all pods were ready}), the exit code is
+    0 when all pods are ready, WAIT_FAILED_EXIT_CODE as soon as a pod is crashing or
+    can't pull its image, WAIT_TIMEOUT_EXIT_CODE after timeout seconds."""
+    table = _run_watch(targets, appname, canary=canary, report=report,
+                       quiet=not watch, timeout=timeout, fail_fast=True)
+    if table.failures:
+        for cluster, name, reason in table.failures:
+            name = '{}/{}'.format(cluster, name) if table.show_cluster else name
+            click.echo(error('pod {} is {}'.format(name, reason)))
+        return WAIT_FAILED_EXIT_CODE, table.ready_at
+    not_ready = [c for c in sorted(table.replicas) if not table.is_ready(c)]
+    if not_ready:
+        for cluster in not_ready:
+            click.echo(error('{}: {}/{} pods ready{}, {}'.format(
+                cluster, table.ready_pods[cluster], table.replicas[cluster],
+                ', rollout not finished' if table.pods_ready(cluster) else '',
+                'timeout after {}s'.format(timeout) if table.timed_out else table.states[cluster])))
+        return (WAIT_TIMEOUT_EXIT_CODE if table.timed_out else WAIT_FAILED_EXIT_CODE), table.ready_at
+    click.echo(info('all pods of {} are ready in {:.1f}s'.format(
+        appname, max(table.ready_at.values() or [0]))))
+    return 0, table.ready_at
+
+
+def display_pods(kae, watcher, appname, canary=False, forever=False, report=None):
+    return watch_pods({kae.cluster: (kae, watcher)}, appname, canary=canary, forever=forever, report=report)
+
+
+def display_multi_cluster_pods(targets, appname, canary=False, report=None):
+    """watch pods of several clusters at once in one merged table.
+    targets: {cluster: (kae, watcher)}
+    return {cluster: seconds until all pods were ready, None if never}"""
+    return watch_pods(targets, appname, canary=canary, report=report)
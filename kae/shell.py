@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+interactive shell, all commands run in one process and share one
+authenticated KaeAPI, so they don't pay for login and new connections.
+"""
+from __future__ import print_function, division, absolute_import
+import time
+import shlex
+import threading
+
+import click
+from prettytable import PrettyTable
+
+from kae.utils import (
+    info, warn, error, get_cache_dir, read_json_file, write_json_file, get_sso_token_entry,
+)
+
+# how long the app list used by tab completion is trusted
+_APP_LIST_TTL = 600
+_SHELL_COMMANDS = (':timing', ':help', ':quit')
+
+
+class TokenRefresher(threading.Thread):
+    """refresh the access token of kae_api before it expires"""
+
+    def __init__(self, kae_api, config, entry, totp=None, cache_path=None):
+        super(TokenRefresher, self).__init__()
+        self.daemon = True
+        self.kae_api = kae_api
+        self.config = config
+        self.entry = entry
+        self.totp = totp
+        self.cache_path = cache_path
+        self.stopped = threading.Event()
+
+    def refresh(self):
+        self.entry = get_sso_token_entry(
+            user=self.config['sso_username'],
+            password=self.config['sso_password'],
+            sso_host=self.config['sso_host'],
+            realm=self.config.get('sso_realm', "kae"),
+            client_id=self.config.get('sso_client_id', "kae-cli"),
+            totp=self.totp,
+            cache_path=self.cache_path,
+            entry=self.entry,
+        )
+        self.kae_api.set_access_token(self.entry['access_token'])
+
+    def run(self):
+        # expires_at already contains a safety margin
+        wait = self.entry['expires_at'] - time.time()
+        while not self.stopped.wait(max(wait, 5)):
+            try:
+                self.refresh()
+                wait = self.entry['expires_at'] - time.time()
+            except Exception as e:
+                click.echo(warn('\nrefresh sso token failed: {}'.format(str(e))))
+                wait = 30
+
+    def stop(self):
+        self.stopped.set()
+
+
+class AppNameCache(object):
+    """app names for tab completion, kept on disk for _APP_LIST_TTL seconds
+    and fetched in background"""
+
+    def __init__(self, kae_api):
+        self.kae_api = kae_api
+        self.path = get_cache_dir('apps.json')
+        self.names = []
+        cached = read_json_file(self.path)
+        if isinstance(cached, dict):
+            self.names = cached.get('names', [])
+            if time.time() - cached.get('updated', 0) < _APP_LIST_TTL:
+                return
+        t = threading.Thread(target=self.fetch)
+        t.daemon = True
+        t.start()
+
+    def fetch(self):
+        try:
+            apps = self.kae_api.list_app()
+        except Exception:
+            return
+        self.names = sorted(app['name'] for app in apps if isinstance(app, dict) and 'name' in app)
+        try:
+            write_json_file({'updated': time.time(), 'names': self.names}, self.path)
+        except (OSError, IOError):
+            pass
+
+
+class Shell(object):
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.group = ctx.find_root().command
+        self.app_names = AppNameCache(ctx.obj['kae_api'])
+        # (command line, exit code, seconds)
+        self.history = []
+
+    def command_names(self):
+        names = [name for name in self.group.list_commands(self.ctx) if name != 'shell']
+        return names + list(_SHELL_COMMANDS)
+
+    def complete(self, text, state):
+        import readline
+
+        line = readline.get_line_buffer()
+        if ' ' in line.lstrip():
+            candidates = self.app_names.names
+        else:
+            candidates = self.command_names()
+        matches = [c for c in candidates if c.startswith(text)]
+        return matches[state] if state < len(matches) else None
+
+    def setup_readline(self):
+        try:
+            import readline
+        except ImportError:
+            return
+        readline.set_completer(self.complete)
+        # `:` is part of command names
+        readline.set_completer_delims(' \t\n')
+        if 'libedit' in (readline.__doc__ or ''):
+            readline.parse_and_bind('bind ^I rl_complete')
+        else:
+            readline.parse_and_bind('tab: complete')
+
+    def run_command(self, args):
+        name, cmd_args = args[0], args[1:]
+        cmd = self.group.get_command(self.ctx, name) if name != 'shell' else None
+        if cmd is None:
+            click.echo(error('unknown command {}, type :help to list commands'.format(name)))
+            return
+
+        code = 0
+        start = time.time()
+        try:
+            cmd.main(args=cmd_args, prog_name=name, obj=self.ctx.obj, standalone_mode=False)
+        except SystemExit as e:
+            # fatal() and --help exit
+            code = e.code if isinstance(e.code, int) else 1
+        except click.ClickException as e:
+            e.show()
+            code = e.exit_code
+        except click.Abort:
+            click.echo(error('Aborted!'))
+            code = 1
+        except KeyboardInterrupt:
+            click.echo(error('\nInterrupted!'))
+            code = 130
+        except Exception as e:
+            click.echo(error('{}: {}'.format(type(e).__name__, str(e))))
+            code = 1
+        self.history.append((' '.join(args), code, time.time() - start))
+
+    def print_timing(self):
+        table = PrettyTable(['command', 'exit', 'ms'])
+        table.align['command'] = 'l'
+        table.align['ms'] = 'r'
+        for line, code, elapsed in self.history:
+            table.add_row([line, code, '{:.1f}'.format(elapsed * 1000)])
+        click.echo(table)
+
+        per_command = {}
+        for line, _, elapsed in self.history:
+            per_command.setdefault(line.split()[0], []).append(elapsed)
+        summary = PrettyTable(['command', 'count', 'avg ms', 'max ms'])
+        summary.align['command'] = 'l'
+        for name, times in sorted(per_command.items()):
+            summary.add_row([name, len(times), '{:.1f}'.format(sum(times) / len(times) * 1000),
+                             '{:.1f}'.format(max(times) * 1000)])
+        click.echo(summary)
+
+    def loop(self):
+        self.setup_readline()
+        click.echo(info('KAE shell, type :help to list commands, :quit or Ctrl-D to exit'))
+        while True:
+            try:
+                line = input('kae> ')
+            except EOFError:
+                click.echo('')
+                return
+            except KeyboardInterrupt:
+                click.echo('')
+                continue
+
+            try:
+                args = shlex.split(line)
+            except ValueError as e:
+                click.echo(error(str(e)))
+                continue
+            if not args:
+                continue
+            if args[0] in (':quit', 'exit', 'quit'):
+                return
+            elif args[0] == ':timing':
+                self.print_timing()
+            elif args[0] == ':help':
+                click.echo('\n'.join(self.command_names()))
+            else:
+                self.run_command(args)
+
+
+@click.pass_context
+def shell(ctx):
+    """interactive shell which reuses one login and connection"""
+    refresher = TokenRefresher(ctx.obj['kae_api'], ctx.obj['config'], ctx.obj['token_entry'],
+                               totp=ctx.obj['totp'], cache_path=ctx.obj['token_cache_path'])
+    refresher.start()
+    try:
+        Shell(ctx).loop()
+    finally:
+        refresher.stop()
@@ -6,15 +6,21 @@
 """
 from __future__ import print_function, division, absolute_import
 
-import yaml
 import click
 from prettytable import PrettyTable
-from pprint import pprint
 import os
+import hashlib
 
 from kae.utils import (
-    abort_if_false, fatal, info, handle_console_err, error, read_yaml_file
+    abort_if_false, fatal, info, handle_console_err, error, read_yaml_file,
+    load_yaml, get_cache_dir, read_json_file, write_json_file,
 )
+from kae.upload import DEFAULT_UPLOAD_CONCURRENCY, UploadManifest, upload_files
+from kae.bundle import BundleError, build_bundle
+from kae.output import output_option, get_output_format, echo_data
+
+# spark:create takes paths with these prefixes as they are, others are uploaded
+REMOTE_FILE_PROTOCOLS = ('s3a://', 'hdfs://')
 
 
 @click.argument('mainFile', required=False)
@@ -41,11 +47,14 @@ from kae.utils import (
 @click.option('--number-executors', type=int, default=1)
 @click.option('--selector', multiple=True, help='Selector')
 @click.option('--comment', help='comment')
+@click.option('--upload-concurrency', default=DEFAULT_UPLOAD_CONCURRENCY, type=int, help='max uploads at the same time')
+@click.option('--force-upload', default=False, is_flag=True, help='upload files even if they are unchanged since the last upload')
 @click.pass_context
 def create_sparkapp(ctx, mainfile, arguments, f, appname, apptype, schedule, concurrency_policy,
                     image, pythonversion, conf, sparkversion, mode,
                     jars, files, py_files, packages, repositories, driver_memory, driver_cores,
-                    executor_memory, executor_cores, number_executors, selector, comment):
+                    executor_memory, executor_cores, number_executors, selector, comment,
+                    upload_concurrency, force_upload):
     kae = ctx.obj['kae_api']
     data = {}
     required = ['appname', 'image', 'mainfile']
@@ -128,13 +137,8 @@ def create_sparkapp(ctx, mainfile, arguments, f, appname, apptype, schedule, con
 
     data.setdefault('deps', {})
 
-    jars_obj = []
-    files_obj = []
-    pyfiles_obj = []
-
-    remote_jars = []
-    remote_files = []
-    remote_pyfiles = []
+    local_files = {'mainfile': [], 'jars': [], 'files': [], 'pyfiles': []}
+    remote_files = {'jars': [], 'files': [], 'pyfiles': []}
 
     # file_type_map = {
     #     'mainfile': 'mainApplicationFile',
@@ -142,41 +146,31 @@ def create_sparkapp(ctx, mainfile, arguments, f, appname, apptype, schedule, con
     #     'files': 'files',
     #     'py-files': 'pyFiles'
     # }
-    remote_file_protocol = ['s3a://', 'hdfs://']
-
     def pre_upload(path):
         protocol = path.split('//')[0] + '//'
-        if protocol in remote_file_protocol:
+        if protocol in REMOTE_FILE_PROTOCOLS:
             return False
         if not os.path.exists(path):
             fatal('File {} not exist'.format(path))
         return True
 
     if pre_upload(data['mainfile']):
-        mainfile_obj = (('file', open(data['mainfile'], 'rb')), )
-        data['mainApplicationFile'] = kae.upload(data['appname'], 'mainfile', mainfile_obj)['data']['path']
-    else:
-        data['mainApplicationFile'] = data['mainfile']
+        local_files['mainfile'].append(data['mainfile'])
+    for key, filetype in (('jars', 'jars'), ('files', 'files'), ('py-files', 'pyfiles')):
+        for path in data.get(key, []):
+            if pre_upload(path):
+                local_files[filetype].append(path)
+            else:
+                remote_files[filetype].append(path)
 
-    for jar_path in data.get('jars', []):
-        if pre_upload(jar_path):
-            jars_obj.append(('file', open(jar_path, 'rb')))
-        else:
-            remote_jars.append(jar_path)
-    for file_path in data.get('files', []):
-        if pre_upload(file_path):
-            files_obj.append(('file', open(file_path, 'rb')))
-        else:
-            remote_files.append(file_path)
-    for pyfile_path in data.get('py-files', []):
-        if pre_upload(pyfile_path):
-            pyfiles_obj.append(('file', open(pyfile_path, 'rb')))
-        else:
-            remote_pyfiles.append(pyfile_path)
+    with handle_console_err():
+        manifest = UploadManifest(kae, data['appname'], force=force_upload)
+        uploaded = upload_files(kae, data['appname'], local_files, concurrency=upload_concurrency, manifest=manifest)
 
-    data['deps']['jars'] = kae.upload(data['appname'], 'jars', jars_obj)['data']['path'] + remote_jars
-    data['deps']['files'] = kae.upload(data['appname'], 'files', files_obj)['data']['path'] + remote_files
-    data['deps']['pyFiles'] = kae.upload(data['appname'], 'pyfiles', pyfiles_obj)['data']['path'] + remote_pyfiles
+    data['mainApplicationFile'] = uploaded['mainfile'][0] if uploaded['mainfile'] else data['mainfile']
+    data['deps']['jars'] = uploaded['jars'] + remote_files['jars']
+    data['deps']['files'] = uploaded['files'] + remote_files['files']
+    data['deps']['pyFiles'] = uploaded['pyfiles'] + remote_files['pyfiles']
 
     with handle_console_err():
         kae.create_sparkapp(data=data)
@@ -184,27 +178,94 @@ def create_sparkapp(ctx, mainfile, arguments, f, appname, apptype, schedule, con
     click.echo(info('Create sparkapp done.'))
 
 
-@click.option('--raw', default=False, is_flag=True, help='print the raw json')
+SPARKAPP_COLUMNS = ['name', 'type', 'd-cores', 'd-memory', 'e-cores', 'e-memory', 'e-number',
+                    'status', 'user', 'craeted', 'schedule', 'concurrency']
+# entries kept in the spec columns cache file
+_SPEC_CACHE_SIZE = 20000
+
+
+class SpecColumnsCache(object):
+    """the columns spark:list needs from a specs_text, keyed by the sha1 of
+    the text, kept in the cache dir so unchanged specs are never parsed again.
+    the least recently used entries go once there are more than
+    _SPEC_CACHE_SIZE, hits only move up when the file is written for a miss"""
+
+    def __init__(self, path=None):
+        self.path = path or get_cache_dir('sparkapp_specs.json')
+        self.dirty = False
+        try:
+            columns = read_json_file(self.path)
+        except ValueError:
+            columns = None
+        # oldest first, dicts keep the insertion order
+        self.columns = columns if isinstance(columns, dict) else {}
+
+    def get(self, specs_text):
+        key = hashlib.sha1(specs_text.encode('utf-8')).hexdigest()
+        columns = self.columns.pop(key, None)
+        if columns is not None:
+            self.columns[key] = columns
+        else:
+            specs = load_yaml(specs_text)
+            columns = self.columns[key] = [
+                specs['apptype'], specs['driver']['cpu'], specs['driver']['memory'],
+                specs['executor']['cpu'], specs['executor']['memory'], specs['executor']['instances'],
+                specs.get('schedule', None), specs.get('concurrencyPolicy', None),
+            ]
+            self.dirty = True
+        return columns
+
+    def save(self):
+        if not self.dirty:
+            return
+        if len(self.columns) > _SPEC_CACHE_SIZE:
+            self.columns = dict(list(self.columns.items())[-_SPEC_CACHE_SIZE:])
+        try:
+            write_json_file(self.columns, self.path)
+        except (OSError, IOError):
+            pass
+
+
+@output_option
+@click.option('--status', help='only apps in this status')
+@click.option('--user', help='only apps of this user')
+@click.option('--offset', default=0, type=int, help='skip the first N apps')
+@click.option('--limit', default=0, type=int, help='show at most N apps, 0 shows all')
+@click.option('--stream', default=False, is_flag=True, help='print tab separated rows as they are processed')
 @click.pass_context
-def list_sparkapp(ctx, raw):
+def list_sparkapp(ctx, output, raw, status, user, offset, limit, stream):
     kae = ctx.obj['kae_api']
     with handle_console_err():
         sparkapps = kae.list_sparkapp()
 
-    if raw:
-        pprint(sparkapps)
-    else:
-        table = PrettyTable(['name', 'type', 'd-cores', 'd-memory', 'e-cores', 'e-memory', 'e-number',
-                            'status', 'user', 'craeted', 'schedule', 'concurrency'])
-        for r in sparkapps:
-            specs_text = yaml.safe_load(r['specs_text'])
-
-            table.add_row([
-                r['name'], specs_text['apptype'], specs_text['driver']['cpu'], specs_text['driver']['memory'],
-                specs_text['executor']['cpu'], specs_text['executor']['memory'], specs_text['executor']['instances'],
-                r['status'], r['nickname'], r['created'], specs_text.get('schedule', None), specs_text.get('concurrencyPolicy', None)
-            ])
+    # filter before parsing any spec
+    if status:
+        sparkapps = [r for r in sparkapps if r['status'] == status]
+    if user:
+        sparkapps = [r for r in sparkapps if r['nickname'] == user]
+    sparkapps = sparkapps[offset:offset + limit if limit else None]
+
+    fmt = get_output_format(output, raw)
+    if fmt not in ('table', 'wide'):
+        # the specs are printed as they are, no need to parse them
+        echo_data(sparkapps, fmt)
+        return
+
+    cache = SpecColumnsCache()
+    table = PrettyTable(SPARKAPP_COLUMNS)
+    if stream:
+        click.echo('\t'.join(SPARKAPP_COLUMNS))
+    for r in sparkapps:
+        apptype, d_cpu, d_mem, e_cpu, e_mem, e_num, schedule, concurrency = cache.get(r['specs_text'])
+        row = [r['name'], apptype, d_cpu, d_mem, e_cpu, e_mem, e_num,
+               r['status'], r['nickname'], r['created'], schedule, concurrency]
+        if stream:
+            click.echo('\t'.join(str(c) for c in row))
+        else:
+            table.add_row(row)
+    cache.save()
 
+    if not stream:
         click.echo(table)
 
 
@@ -265,22 +326,46 @@ def get_sparkapp_log(ctx, appname, follow):
 @click.argument('files', nargs=-1, required=True)
 @click.option('--appname', required=True, help='appname')
 @click.option('--type', required=True, help='file type. mainfile, jars, pyfiles or files')
+@click.option('--concurrency', default=DEFAULT_UPLOAD_CONCURRENCY, type=int, help='max uploads at the same time')
+@click.option('--force-upload', default=False, is_flag=True, help='upload files even if they are unchanged since the last upload')
 @click.pass_context
-def upload(ctx, appname, files, type):
-    upload_files = []
-
+def upload(ctx, appname, files, type, concurrency, force_upload):
     kae = ctx.obj['kae_api']
 
     for f in files:
         if not os.path.exists(f):
             fatal('File {} not exist'.format(f))
-        else:
-            upload_files.append(('file', (f, open(f, 'rb'))))
 
     with handle_console_err():
-        res = kae.upload(appname, type, upload_files)
-
-    if res['error']:
-        fatal(res['error'])
+        manifest = UploadManifest(kae, appname, force=force_upload)
+        upload_files(kae, appname, {type: list(files)}, concurrency=concurrency, manifest=manifest)
 
     click.echo(info('upload successful'))
+
+
+@click.argument('packages', nargs=-1, required=True)
+@click.option('--appname', required=True, help='appname')
+@click.option('-r', '--requirements', type=click.Path(exists=True, dir_okay=False),
+              help='requirements file, installed into the bundle')
+@click.option('--rebuild', default=False, is_flag=True, help='build the bundle even if it is cached')
+@click.option('--no-upload', default=False, is_flag=True, help='only build the bundle')
+@click.option('--force-upload', default=False, is_flag=True, help='upload the bundle even if it was uploaded before')
+@click.pass_context
+def bundle(ctx, packages, appname, requirements, rebuild, no_upload, force_upload):
+    """zip local package dirs and requirements into one py-files bundle and upload it"""
+    try:
+        path, built = build_bundle(packages, requirements, name='{}-pyfiles'.format(appname), force=rebuild)
+    except BundleError as e:
+        fatal(str(e))
+    click.echo('{} bundle {} ({} bytes)'.format('built' if built else 'cached', path, os.path.getsize(path)))
+    if no_upload:
+        return
+
+    kae = ctx.obj['kae_api']
+    with handle_console_err():
+        manifest = UploadManifest(kae, appname, force=force_upload)
+        remote = upload_files(kae, appname, {'pyfiles': [path]}, manifest=manifest)['pyfiles'][0]
+    # spark:create needs any other path to exist locally, the local bundle
+    # is found in the upload manifest then and not uploaded again
+    submit = remote if remote.startswith(REMOTE_FILE_PROTOCOLS) else path
+    click.echo(info('bundle uploaded to {}, submit with `kae spark:create --py-files {}`'.format(remote, submit)))
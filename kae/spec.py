@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+app.yaml is read at most once per invocation, parsed and validated on demand.
+the parse and validation results of a file are also memoized on disk by
+path+mtime and the kaelib version, so a big app.yaml isn't parsed again by
+every command. the memo is json, the cache dir may be shared(e.g. a CI
+cache) and json can't run code when it's read.
+"""
+from __future__ import print_function, division, absolute_import
+import os
+import json
+import hashlib
+import functools
+import importlib.util
+import yaml
+
+from kae import __VERSION__
+from kae.utils import load_yaml, get_cache_dir, read_json_file, write_json_file
+
+_UNSET = object()
+
+
+class SpecError(Exception):
+    pass
+
+
+class AppSpec(object):
+    def __init__(self, specs_text, path=None, stat_key=None):
+        self.specs_text = specs_text
+        self.path = path
+        self.stat_key = stat_key
+        self._data = _UNSET
+        self._specs = _UNSET
+        self._disk_cache_loaded = False
+
+    @property
+    def data(self):
+        """the raw yaml data"""
+        if self._data is _UNSET:
+            self._load_disk_cache()
+        if self._data is _UNSET:
+            try:
+                self._data = load_yaml(self.specs_text)
+            except yaml.YAMLError as e:
+                raise SpecError('specs text is invalid yaml {}'.format(str(e)))
+            self._save_disk_cache()
+        return self._data
+
+    @property
+    def specs(self):
+        """the data validated by app_specs_schema"""
+        if self._specs is _UNSET:
+            self._load_disk_cache()
+        if self._specs is _UNSET:
+            from kaelib.spec import app_specs_schema
+
+            try:
+                self._specs = app_specs_schema.load(self.data).data
+            except Exception as e:
+                raise SpecError('specs text is invalid: {}'.format(str(e)))
+            self._save_disk_cache()
+        return self._specs
+
+    @property
+    def appname(self):
+        data = self.data
+        if not isinstance(data, dict):
+            return ''
+        return data.get('appname', '')
+
+    @property
+    def builds(self):
+        return self.specs['builds']
+
+    @property
+    def test(self):
+        """test section, None if app.yaml doesn't have one"""
+        return self.specs['test'] if 'test' in self.specs else None
+
+    def _disk_cache_path(self):
+        return get_cache_dir('appspec', hashlib.sha1(self.path.encode('utf8')).hexdigest() + '.json')
+
+    def _load_disk_cache(self):
+        if self._disk_cache_loaded or self.path is None:
+            return
+        self._disk_cache_loaded = True
+        try:
+            entry = read_json_file(self._disk_cache_path())
+        except ValueError:
+            return
+        if (not isinstance(entry, dict) or entry.get('version') != __VERSION__ or
+                entry.get('schema_version') != _schema_version() or entry.get('stat_key') != list(self.stat_key)):
+            return
+        self._data = entry['data']
+        if entry['specs'] is not None:
+            from addict import Dict
+
+            self._specs = Dict(entry['specs'])
+
+    def _save_disk_cache(self):
+        if self.path is None:
+            return
+        entry = {
+            'version': __VERSION__,
+            'schema_version': _schema_version(),
+            'stat_key': list(self.stat_key),
+            'data': self._data,
+            'specs': None if self._specs is _UNSET else self._specs.to_dict(),
+        }
+        try:
+            # yaml has types json hasn't(dates, int keys), such a spec isn't cached
+            if json.loads(json.dumps(entry)) != entry:
+                return
+            write_json_file(entry, self._disk_cache_path())
+        except (OSError, IOError, TypeError, ValueError):
+            # the cache is only an optimization
+            pass
+
+
+@functools.lru_cache(maxsize=1)
+def _schema_version():
+    """version of the installed kaelib, its schema makes the specs. taken
+    from the package metadata plus the mtime of kaelib/spec.py(for editable
+    installs), importing kaelib would cost more than the cache saves"""
+    spec = importlib.util.find_spec('kaelib')
+    if spec is None or not spec.origin:
+        return None
+    package_dir = os.path.dirname(spec.origin)
+    version = None
+    try:
+        for name in os.listdir(os.path.dirname(package_dir)):
+            if name.startswith('kaelib-') and name.endswith(('.dist-info', '.egg-info')):
+                version = name[len('kaelib-'):].rsplit('.', 1)[0]
+                break
+        st = os.stat(os.path.join(package_dir, 'spec.py'))
+    except OSError:
+        return version
+    return '{} {} {}'.format(version, st.st_mtime_ns, st.st_size)
+
+
+_app_specs = {}
+
+
+def load_app_spec(path):
+    """AppSpec of file `path`, raise IOError if it can't be read"""
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    stat_key = (st.st_mtime_ns, st.st_size)
+    spec = _app_specs.get(path)
+    if spec is None or spec.stat_key != stat_key:
+        with open(path, 'r') as f:
+            spec = AppSpec(f.read(), path=path, stat_key=stat_key)
+        _app_specs[path] = spec
+    return spec
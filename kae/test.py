@@ -6,23 +6,155 @@
 """
 from __future__ import print_function, division, absolute_import
 import os
-import yaml
+import time
 import click
+import yaml
+from prettytable import PrettyTable
 
-from kaelib.spec import app_specs_schema
 from kae.utils import (
     get_appname, get_current_branch, get_remote_url, get_git_tag,
-    get_specs_text, error, info, fatal, handle_console_err,
-    display_pods,
+    error, info, warn, fatal, handle_console_err, format_size,
+    read_yaml_file,
 )
-from kae.docker import build_image, run_container
+from kae.spec import AppSpec, SpecError, load_app_spec
+from kae.docker import BuildTask, build_images
+from kae.testrun import (
+    EntrypointResult, run_entrypoints, lookup_cache, record_cache, show_summary, write_junit, write_json,
+)
+from kae.context import TestIndex, analyze_context, read_dockerignore
+
+DEFAULT_CONTEXT_WARN_SIZE = 100
+# the BuildKit settings of the builds, app.yaml's schema has no room for them
+BUILD_CONFIG_FILE = 'kae-build.yaml'
+_BUILD_CACHE_KEYS = ('buildkit', 'cache_from', 'cache_to', 'inline_cache')
+
+
+def context_warn_size_option(f):
+    return click.option('--context-warn-size', default=DEFAULT_CONTEXT_WARN_SIZE, type=int,
+                        envvar='KAE_CONTEXT_WARN_SIZE',
+                        help='warn if the build context is larger than N MB, 0 never warns')(f)
+
+
+def build_cache_options(f):
+    f = click.option('--inline-cache', default=False, is_flag=True, envvar='KAE_INLINE_CACHE',
+                     help='write cache metadata into the images, so they can be used by --cache-from')(f)
+    f = click.option('--cache-to', multiple=True, envvar='KAE_CACHE_TO',
+                     help='export the build cache, e.g. type=registry,ref=REPO/{name}:buildcache or a dir, needs buildx')(f)
+    f = click.option('--cache-from', multiple=True, envvar='KAE_CACHE_FROM',
+                     help='import build cache from an image, a cache ref or a dir, {name} is the build name')(f)
+    return click.option('--buildkit', default=False, is_flag=True, envvar='KAE_BUILDKIT',
+                        help='build with BuildKit')(f)
+
+
+def _load_build_config(repo_dir):
+    """kae-build.yaml in repo_dir, looks like:
+    buildkit: true
+    cache_from: ['REPO/{name}:buildcache']
+    builds:
+      <build name>:
+        cache_to: ['type=registry,ref=REPO/{name}:buildcache,mode=max']
+    """
+    path = os.path.join(repo_dir, BUILD_CONFIG_FILE)
+    try:
+        config = read_yaml_file(path) or {}
+    except yaml.YAMLError as e:
+        fatal('{} is invalid yaml {}'.format(path, str(e)))
+    sections = [config] + list((config.get('builds') or {}).values())
+    for section in sections:
+        unknown = set(section) - set(_BUILD_CACHE_KEYS) - ({'builds'} if section is config else set())
+        if unknown:
+            fatal('unknown fields in {}: {}'.format(path, ', '.join(sorted(unknown))))
+    return config
+
+
+def _build_cache(config, name, buildkit=False, cache_from=(), cache_to=(), inline_cache=False):
+    """cache settings of build `name`: kae-build.yaml, its section of the
+    build, then the command line"""
+    cache = {k: config[k] for k in _BUILD_CACHE_KEYS if k in config}
+    cache.update((config.get('builds') or {}).get(name) or {})
+    if buildkit:
+        cache['buildkit'] = True
+    if inline_cache:
+        cache['inline_cache'] = True
+    if cache_from:
+        cache['cache_from'] = list(cache_from)
+    if cache_to:
+        cache['cache_to'] = list(cache_to)
+    for key in ('cache_from', 'cache_to'):
+        values = cache.get(key) or []
+        if not isinstance(values, list):
+            values = [values]
+        cache[key] = [v.format(name=name) for v in values]
+    return cache
+
+
+def _check_context_size(repo_dir, warn_size):
+    if not warn_size:
+        return
+    stats = analyze_context(repo_dir, depth=1)
+    if stats.total_size > warn_size * 1024 * 1024:
+        top = ', '.join('{} {}'.format(d, format_size(size)) for d, (size, _) in stats.largest_dirs(3))
+        click.echo(warn('build context {} is {} in {} files (largest: {}), '
+                        'run `kae build:context` for a .dockerignore suggestion'.format(
+                            repo_dir, format_size(stats.total_size), stats.file_count, top)))
+
+
+def _load_app_spec(repo_dir, f, literal):
+    """validated AppSpec from --literal, -f or app.yaml in repo_dir"""
+    if literal:
+        app_spec = AppSpec(literal)
+    else:
+        try:
+            app_spec = load_app_spec(f or os.path.join(repo_dir, 'app.yaml'))
+        except IOError:
+            if f:
+                fatal("can't read specs text from {}".format(f))
+            errmsg = [
+                "specs_text is required, please use one of the instructions to specify it.",
+                "1. specify --literal or -f in coomand line",
+                "2. make the current workdir in the source code dir which contains app.yaml"
+            ]
+            fatal('\n'.join(errmsg))
+    try:
+        app_spec.specs
+    except SpecError as e:
+        fatal(str(e))
+    return app_spec
+
+
+def _build_tasks(repo_dir, builds, tag, skip_unchanged, **cache_options):
+    config = _load_build_config(repo_dir)
+    tasks = []
+    for build in builds:
+        image_tag = build.tag if build.tag else tag
+        dockerfile = build.get('dockerfile', None)
+        if dockerfile is None:
+            dockerfile = os.path.join(repo_dir, "Dockerfile")
+        full_image_name = "{}:{}".format(build.name, image_tag)
+        build_args = ['{}={}'.format(k, v) for k, v in (build.get('args', None) or {}).items()]
+        tasks.append(BuildTask(build.name or full_image_name, full_image_name, repo_dir, dockerfile=dockerfile,
+                               build_args=build_args, skip_unchanged=skip_unchanged,
+                               target=build.get('target', None),
+                               cache=_build_cache(config, build.name, **cache_options)))
+    return tasks
 
 
 @click.argument('appname', required=False)
 @click.argument('tag', required=False)
 @click.option('-f', help='filename of specs')
 @click.option('--literal')
-def test(appname, tag, f, literal):
+@click.option('--parallel', default=1, type=int, help='run at most N image builds or test entrypoints at the same time')
+@click.option('--no-skip', default=False, is_flag=True, help="build images even if their inputs didn't change")
+@click.option('--keep-going', default=False, is_flag=True, help='run the rest of the script after a step failed')
+@click.option('--junit', type=click.Path(dir_okay=False), help='write a junit xml report of the steps to this file')
+@click.option('--report-json', type=click.Path(dir_okay=False), help='write a json report of the steps to this file')
+@click.option('--no-test-cache', default=False, is_flag=True, envvar='KAE_NO_TEST_CACHE',
+              help='run entrypoints even if they passed before with the same image, script and volumes, '
+                   'set KAE_CACHE_DIR to the cache dir of CI to share the results between pipelines')
+@context_warn_size_option
+@build_cache_options
+def test(appname, tag, f, literal, parallel, no_skip, keep_going, junit, report_json, no_test_cache,
+         context_warn_size, buildkit, cache_from, cache_to, inline_cache):
     """build test image and run test script in app.yaml"""
     repo_dir = os.getcwd()
     if f:
@@ -33,41 +165,41 @@ def test(appname, tag, f, literal):
     if tag is None:
         tag = 'latest'
 
-    specs_text = get_specs_text(f, literal)
-    if specs_text is None:
-        errmsg = [
-            "specs_text is required, please use one of the instructions to specify it.",
-            "1. specify --literal or -f in coomand line",
-            "2. make the current workdir in the source code dir which contains app.yaml"
-        ]
-        fatal('\n'.join(errmsg))
-    try:
-        yaml_dict = yaml.load(specs_text)
-    except yaml.YAMLError as e:
-        fatal('specs text is invalid yaml {}'.format(str(e)))
-    try:
-        specs = app_specs_schema.load(yaml_dict).data
-    except Exception as e:
-        fatal('specs text is invalid: {}'.format(str(e)))
-    if "test" not in specs:
+    app_spec = _load_app_spec(repo_dir, f, literal)
+    test_specs = app_spec.test
+    if test_specs is None:
         fatal("no test specified in app.yaml")
-    builds = specs['test']['builds']
+    builds = test_specs['builds']
     if len(builds) == 0:
-        builds = specs["builds"]
-    for build in builds:
-        image_tag = build.tag if build.tag else tag
-        dockerfile = build.get('dockerfile', None)
-        if dockerfile is None:
-            dockerfile = os.path.join(repo_dir, "Dockerfile")
-        full_image_name = "{}:{}".format(build.name, image_tag)
-        build_image(full_image_name, repo_dir, None, dockerfile=dockerfile)
+        builds = app_spec.builds
+    _check_context_size(repo_dir, context_warn_size)
+    tasks = _build_tasks(repo_dir, builds, tag, skip_unchanged=not no_skip, buildkit=buildkit,
+                         cache_from=cache_from, cache_to=cache_to, inline_cache=inline_cache)
+    build_images(tasks, parallel=parallel)
 
     default_image_name = "{}:{}".format(appname, tag)
-    for entrypoint in specs['test']['entrypoints']:
+    results = []
+    for i, entrypoint in enumerate(test_specs['entrypoints']):
         image = entrypoint.image if entrypoint.image else default_image_name
-        cmd = entrypoint.script
         volumes = entrypoint.get('volumes', [])
-        run_container(image, volumes, cmd)
+        results.append(EntrypointResult('entrypoint-{}'.format(i + 1), image, volumes, entrypoint.script))
+    if not results:
+        return
+
+    start = time.time()
+    index = TestIndex()
+    lookup_cache(results, index, use_cache=not no_test_cache)
+    to_run = [r for r in results if r.status != 'cached']
+    if to_run:
+        run_entrypoints(to_run, parallel=parallel, keep_going=keep_going)
+        record_cache(to_run, index)
+    show_summary(results, time.time() - start)
+    if junit:
+        write_junit(results, junit)
+    if report_json:
+        write_json(results, report_json)
+    if any(r.status not in ('passed', 'cached') for r in results):
+        fatal('test failed. See errors above.')
 
 
 @click.argument('appname', required=False)
@@ -75,7 +207,12 @@ def test(appname, tag, f, literal):
 @click.option('-f', help='filename of specs')
 @click.option('--literal')
 @click.option('--test', default=False, is_flag=True, help='build test image')
-def build_local(appname, tag, f, literal, test):
+@click.option('--parallel', default=1, type=int, help='run at most N image builds at the same time')
+@click.option('--no-skip', default=False, is_flag=True, help="build images even if their inputs didn't change")
+@context_warn_size_option
+@build_cache_options
+def build_local(appname, tag, f, literal, test, parallel, no_skip, context_warn_size,
+                buildkit, cache_from, cache_to, inline_cache):
     """build local image """
     repo_dir = os.getcwd()
     if f:
@@ -85,35 +222,52 @@ def build_local(appname, tag, f, literal, test):
     if tag is None:
         tag = 'latest'
 
-    specs_text = get_specs_text(f, literal)
-    if specs_text is None:
-        errmsg = [
-            "specs_text is required, please use one of the instructions to specify it.",
-            "1. specify --literal or -f in coomand line",
-            "2. make the current workdir in the source code dir which contains app.yaml"
-        ]
-        fatal('\n'.join(errmsg))
-    try:
-        yaml_dict = yaml.load(specs_text)
-    except yaml.YAMLError as e:
-        fatal('specs text is invalid yaml {}'.format(str(e)))
-    try:
-        specs = app_specs_schema.load(yaml_dict).data
-    except Exception as e:
-        fatal('specs text is invalid: {}'.format(str(e)))
+    app_spec = _load_app_spec(repo_dir, f, literal)
 
-    builds = specs["builds"]
+    builds = app_spec.builds
     if test:
-        if "test" not in specs:
+        if app_spec.test is None:
             fatal("no test specified in app.yaml")
-        builds = specs['test']['builds']
+        builds = app_spec.test['builds']
     if len(builds) == 0:
         fatal("no builds found")
 
-    for build in builds:
-        image_tag = build.tag if build.tag else tag
-        dockerfile = build.get('dockerfile', None)
-        if dockerfile is None:
-            dockerfile = os.path.join(repo_dir, "Dockerfile")
-        full_image_name = "{}:{}".format(build.name, image_tag)
-        build_image(full_image_name, repo_dir, None, dockerfile=dockerfile)
+    _check_context_size(repo_dir, context_warn_size)
+    tasks = _build_tasks(repo_dir, builds, tag, skip_unchanged=not no_skip, buildkit=buildkit,
+                         cache_from=cache_from, cache_to=cache_to, inline_cache=inline_cache)
+    build_images(tasks, parallel=parallel)
+
+
+@click.argument('path', default='.', type=click.Path(exists=True, file_okay=False))
+@click.option('--top', default=10, type=int, help='show the N largest dirs')
+@click.option('--depth', default=2, type=int, help='dir depth of the largest dirs')
+@click.option('--bandwidth', default=50, type=float, help='MB/s to the docker daemon, for the upload time estimate')
+@click.option('--write', default=False, is_flag=True, help='write the suggested .dockerignore')
+def build_context(path, top, depth, bandwidth, write):
+    """show what `docker build` sends as the build context and suggest a .dockerignore"""
+    context = os.path.abspath(path)
+    patterns = read_dockerignore(context)
+    stats = analyze_context(context, depth=depth)
+
+    table = PrettyTable(['dir', 'size', 'files'])
+    table.align['dir'] = 'l'
+    table.align['size'] = 'r'
+    table.align['files'] = 'r'
+    for d, (size, count) in stats.largest_dirs(top):
+        table.add_row([d + '/', format_size(size), count])
+    click.echo(table)
+    click.echo('context {}: {} in {} files, about {:.1f}s to send at {:g}MB/s'.format(
+        context, format_size(stats.total_size), stats.file_count,
+        stats.upload_seconds(bandwidth * 1024 * 1024), bandwidth))
+
+    suggestion = stats.suggest_dockerignore(patterns)
+    if suggestion == patterns:
+        click.echo(info('.dockerignore looks fine'))
+        return
+    if write:
+        with open(os.path.join(context, '.dockerignore'), 'w') as f:
+            f.write('\n'.join(suggestion) + '\n')
+        click.echo(info('.dockerignore written'))
+    else:
+        click.echo(info('suggested .dockerignore:'))
+        click.echo('\n'.join(suggestion))
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+test entrypoints of app.yaml, every one in its own container.
+
+the steps of a script run in one shell, so `cd` and `export` still carry
+over to the next steps, but a marker line is printed around every step,
+the steps are timed when their markers arrive and the output between the
+markers is kept for the junit and json reports. the markers carry a nonce
+of the run and xtrace is off while they're printed, so neither the output
+nor a `set -x` trace of the script can fake one.
+
+an entrypoint which passed before with the same image id, script and bind
+mounted files is not run again but reported as cached, the container's
+environment comes from the image, so the image id covers it.
+"""
+from __future__ import print_function, division, absolute_import
+import os
+import re
+import time
+import uuid
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+
+import click
+from prettytable import PrettyTable
+
+from kae.docker import run_script, image_id
+from kae.context import FileHashes, entrypoint_digest
+from kae.utils import info, error, write_json_file, mkdir_p
+
+_MARKER = '##kae-step'
+# output lines kept per step for the reports
+_OUTPUT_LINES = 200
+_echo_lock = threading.Lock()
+
+
+class StepResult(object):
+    def __init__(self, index, command):
+        self.index = index
+        self.command = command
+        # passed, failed, skipped or cached
+        self.status = 'skipped'
+        self.returncode = None
+        self.duration = 0
+        self.output = deque(maxlen=_OUTPUT_LINES)
+
+    @property
+    def title(self):
+        lines = self.command.strip().splitlines() or ['']
+        title = lines[0] if len(lines) == 1 else lines[0] + ' ...'
+        return 'step {}: {}'.format(self.index + 1, title)
+
+    def to_dict(self):
+        return {
+            'index': self.index,
+            'command': self.command,
+            'status': self.status,
+            'returncode': self.returncode,
+            'duration': round(self.duration, 3),
+            'output': list(self.output),
+        }
+
+
+class EntrypointResult(object):
+    def __init__(self, name, image, volumes, script):
+        self.name = name
+        self.image = image
+        self.volumes = volumes
+        self.script = script
+        self.steps = [StepResult(i, cmd) for i, cmd in enumerate(script)]
+        # passed, failed, error(the container didn't run the script) or cached
+        self.status = None
+        # None if the run can't be cached
+        self.digest = None
+        self.image_id = None
+        self.returncode = None
+        self.duration = 0
+        # output outside of the steps, e.g. pulling the image
+        self.output = deque(maxlen=_OUTPUT_LINES)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'image': self.image,
+            'image_id': self.image_id,
+            'volumes': self.volumes,
+            'status': self.status,
+            'returncode': self.returncode,
+            'duration': round(self.duration, 3),
+            'output': list(self.output),
+            'steps': [step.to_dict() for step in self.steps],
+        }
+
+
+def wrapper_script(script, keep_going=False, nonce=''):
+    """sh script running the steps of script with markers around them.
+    it stops at the first failed step, unless keep_going.
+    the end marker starts with a newline, in case the output of the step
+    didn't end with one, run_entrypoint drops the empty line it makes."""
+    marker = '{}-{}'.format(_MARKER, nonce)
+    lines = ['__kae_status=0', '__kae_flags=']
+    for i, cmd in enumerate(script):
+        lines += [
+            "echo '{} start {}'".format(marker, i),
+            # xtrace set by the previous step
+            'case $__kae_flags in *x*) set -x;; esac',
+            cmd,
+            '{ __kae_rc=$?; __kae_flags=$-; set +x; } 2>/dev/null',
+            "printf '\\n{} end {} %s\\n' \"$__kae_rc\"".format(marker, i),
+        ]
+        if keep_going:
+            lines.append('[ $__kae_rc -eq 0 ] || __kae_status=$__kae_rc')
+        else:
+            lines.append('[ $__kae_rc -eq 0 ] || exit $__kae_rc')
+    lines.append('exit $__kae_status')
+    return '\n'.join(lines) + '\n'
+
+
+def run_entrypoint(result, keep_going=False, prefix='', procs=None):
+    nonce = uuid.uuid4().hex[:12]
+    marker_re = re.compile(r'^{}-{} (start|end) (\d+)(?: (\d+))?$'.format(re.escape(_MARKER), nonce))
+    # [current step, its start time, an empty line held back]
+    current = [None, 0, False]
+
+    def output(line):
+        (current[0].output if current[0] else result.output).append(line)
+        with _echo_lock:
+            click.echo(prefix + line)
+
+    def on_line(line):
+        m = marker_re.match(line)
+        if m is None or int(m.group(2)) >= len(result.steps):
+            if current[2]:
+                output('')
+            current[2] = line == ''
+            if not current[2]:
+                output(line)
+            return
+        # the empty line before an end marker is its leading newline
+        current[2] = False
+        step = result.steps[int(m.group(2))]
+        if m.group(1) == 'start':
+            current[:2] = [step, time.time()]
+        elif m.group(3) is not None:
+            step.duration = time.time() - current[1]
+            step.returncode = int(m.group(3))
+            step.status = 'passed' if step.returncode == 0 else 'failed'
+            current[0] = None
+
+    start = time.time()
+    result.returncode = run_script(result.image, result.volumes, wrapper_script(result.script, keep_going, nonce),
+                                   on_line, procs=procs)
+    result.duration = time.time() - start
+    if current[2]:
+        output('')
+    step = current[0]
+    if step is not None:
+        # the step exited the shell, or the container was killed
+        step.duration = time.time() - current[1]
+        step.returncode = result.returncode
+        step.status = 'passed' if result.returncode == 0 else 'failed'
+    if result.returncode == 0:
+        result.status = 'passed'
+    elif any(s.status == 'failed' for s in result.steps):
+        result.status = 'failed'
+    else:
+        result.status = 'error'
+    return result
+
+
+def run_entrypoints(results, parallel=1, keep_going=False):
+    """run the EntrypointResults, at most `parallel` containers at the same time"""
+    prefix_width = max(len(r.name) for r in results)
+    procs = set()
+
+    def run(result):
+        prefix = '[{}] '.format(result.name.ljust(prefix_width)) if parallel > 1 and len(results) > 1 else ''
+        with _echo_lock:
+            click.echo(info('{}running {} in {} ...'.format(prefix, result.name, result.image)))
+        return run_entrypoint(result, keep_going=keep_going, prefix=prefix, procs=procs)
+
+    with ThreadPoolExecutor(max_workers=max(parallel, 1)) as executor:
+        try:
+            list(executor.map(run, results))
+        except KeyboardInterrupt:
+            for proc in list(procs):
+                proc.terminate()
+            raise
+    return results
+
+
+def lookup_cache(results, index, use_cache=True):
+    """set the digest of the results, those which passed before are marked
+    as cached unless not use_cache"""
+    hashes = FileHashes()
+    for r in results:
+        r.image_id = image_id(r.image)
+        if r.image_id:
+            r.digest = entrypoint_digest(r.image_id, r.script, r.volumes, hashes=hashes)
+        entry = index.lookup(r.digest) if r.digest and use_cache else None
+        if entry:
+            r.status = 'cached'
+            for step in r.steps:
+                step.status = 'cached'
+            click.echo(info('{} passed in image {} {} ago, cached'.format(
+                r.name, r.image_id[7:19], _ago(time.time() - entry['time']))))
+    hashes.save()
+    return results
+
+
+def record_cache(results, index):
+    for r in results:
+        if r.status == 'passed' and r.digest:
+            index.record(r.digest, r.image, r.image_id, round(r.duration, 3))
+
+
+def _ago(seconds):
+    for unit, size in (('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds >= size:
+            return '{}{}'.format(int(seconds // size), unit)
+    return '{}s'.format(int(seconds))
+
+
+def show_summary(results, elapsed):
+    table = PrettyTable(['entrypoint', 'step', 'status', 'time'])
+    table.align['step'] = 'l'
+    for r in results:
+        for step in r.steps:
+            title = step.title if len(step.title) <= 60 else step.title[:57] + '...'
+            table.add_row([r.name, title, step.status, '{:.1f}s'.format(step.duration) if step.returncode is not None else '-'])
+        if r.status == 'error':
+            table.add_row([r.name, 'container', 'error', '{:.1f}s'.format(r.duration)])
+    click.echo(table)
+
+    failed = [r.name for r in results if r.status not in ('passed', 'cached')]
+    summary = '{} entrypoints in {:.1f}s'.format(len(results), elapsed)
+    cached = len([r for r in results if r.status == 'cached'])
+    if cached:
+        summary += ', {} cached'.format(cached)
+    if failed:
+        click.echo(error('{}, failed: {}'.format(summary, ', '.join(failed))))
+    else:
+        click.echo(info(summary))
+
+
+def write_junit(results, path):
+    root = ElementTree.Element('testsuites', name='kae test')
+    totals = {'tests': 0, 'failures': 0, 'errors': 0, 'skipped': 0}
+    for r in results:
+        counts = {
+            'tests': len(r.steps) + (1 if r.status == 'error' else 0),
+            'failures': len([s for s in r.steps if s.status == 'failed']),
+            'errors': 1 if r.status == 'error' else 0,
+            'skipped': len([s for s in r.steps if s.status == 'skipped']),
+        }
+        for k, v in counts.items():
+            totals[k] += v
+        suite = ElementTree.SubElement(root, 'testsuite', name=r.name, time='{:.3f}'.format(r.duration),
+                                       **{k: str(v) for k, v in counts.items()})
+        props = ElementTree.SubElement(suite, 'properties')
+        ElementTree.SubElement(props, 'property', name='image', value=r.image)
+        if r.status == 'error':
+            case = ElementTree.SubElement(suite, 'testcase', classname=r.name, name='container', time='0')
+            e = ElementTree.SubElement(case, 'error', message='exit code {}'.format(r.returncode))
+            e.text = '\n'.join(r.output)
+        for step in r.steps:
+            case = ElementTree.SubElement(suite, 'testcase', classname=r.name, name=step.title,
+                                          time='{:.3f}'.format(step.duration))
+            if step.status == 'failed':
+                e = ElementTree.SubElement(case, 'failure', message='exit code {}'.format(step.returncode))
+                e.text = '\n'.join(step.output)
+            elif step.status == 'cached':
+                ElementTree.SubElement(case, 'system-out').text = 'cached, passed with image {}'.format(r.image_id)
+            elif step.status == 'skipped':
+                reason = "the script didn't run" if r.status == 'error' else 'a previous step failed'
+                ElementTree.SubElement(case, 'skipped', message=reason)
+            if step.output and step.status != 'failed':
+                ElementTree.SubElement(case, 'system-out').text = '\n'.join(step.output)
+    for k, v in totals.items():
+        root.set(k, str(v))
+    root.set('time', '{:.3f}'.format(sum(r.duration for r in results)))
+
+    mkdir_p(os.path.dirname(os.path.abspath(path)))
+    ElementTree.ElementTree(root).write(path, encoding='utf-8', xml_declaration=True)
+
+
+def write_json(results, path):
+    write_json_file({'entrypoints': [r.to_dict() for r in results]}, path)
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+"""
+upload spark dependencies to console.
+
+the multipart body is streamed from disk in chunks, each file is opened only
+when its turn comes and closed as soon as it's sent. file groups(and large
+files on their own) are uploaded concurrently by a bounded pool.
+
+UploadManifest remembers the server path of every uploaded file by content
+hash, so files which didn't change since the last submission are skipped.
+"""
+from __future__ import print_function, division, absolute_import
+import os
+import time
+import uuid
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+from kae.utils import clone_kae_api, get_cache_dir, read_json_file, write_json_file, format_size
+
+CHUNK_SIZE = 256 * 1024
+# files larger than this are sent in their own request
+LARGE_FILE_SIZE = 32 * 1024 * 1024
+DEFAULT_UPLOAD_CONCURRENCY = 4
+
+_MANIFEST_VERSION = 1
+# console has no api to check an uploaded file still exists,
+# so server paths in the manifest are only trusted for a while
+_MANIFEST_TTL = 7 * 24 * 3600
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class UploadManifest(object):
+    """server paths of uploaded files keyed by console, app, file type, file
+    name and content hash, kept in the cache dir. hashes are remembered by
+    (size, mtime) so unchanged files aren't read again.
+    with force=True nothing is reused, but new uploads are still recorded."""
+
+    def __init__(self, kae, appname, force=False, path=None, ttl=_MANIFEST_TTL):
+        self.path = path or get_cache_dir('uploads.json')
+        self.prefix = '{} {}'.format(kae.host, appname)
+        self.force = force
+        self.ttl = ttl
+        try:
+            data = read_json_file(self.path)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict) or data.get('version') != _MANIFEST_VERSION:
+            data = {}
+        # {abs path: [size, mtime_ns, sha256]}
+        self.hashes = data.get('hashes', {})
+        # {key: {'path': server path, 'uploaded': timestamp}}
+        self.uploads = data.get('uploads', {})
+
+    def digest(self, path):
+        st = os.stat(path)
+        abs_path = os.path.abspath(path)
+        cached = self.hashes.get(abs_path)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+        digest = file_sha256(path)
+        self.hashes[abs_path] = [st.st_size, st.st_mtime_ns, digest]
+        return digest
+
+    def _key(self, filetype, path):
+        return '{} {} {} {}'.format(self.prefix, filetype, os.path.basename(path), self.digest(path))
+
+    def lookup(self, filetype, path):
+        if self.force:
+            return None
+        entry = self.uploads.get(self._key(filetype, path))
+        if entry and time.time() - entry['uploaded'] < self.ttl:
+            return entry['path']
+        return None
+
+    def record(self, filetype, path, remote):
+        self.uploads[self._key(filetype, path)] = {'path': remote, 'uploaded': time.time()}
+
+    def save(self):
+        now = time.time()
+        data = {
+            'version': _MANIFEST_VERSION,
+            'hashes': {p: v for p, v in self.hashes.items() if os.path.exists(p)},
+            'uploads': {k: v for k, v in self.uploads.items() if now - v['uploaded'] < self.ttl},
+        }
+        try:
+            write_json_file(data, self.path)
+        except (OSError, IOError):
+            pass
+
+
+class MultipartStream(object):
+    """a multipart/form-data body read lazily by requests.
+
+    fields: [(name, value)], files: [(name, path)]"""
+
+    def __init__(self, fields, files, chunk_size=CHUNK_SIZE):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary={}'.format(self.boundary)
+        self.chunk_size = chunk_size
+        # bytes, or the path of a file to stream
+        self.parts = []
+        # {path: [size, first read time, last read time]}
+        self.stats = {}
+        for name, value in fields:
+            self.parts.append(self._header(name).encode('utf-8') + str(value).encode('utf-8') + b'\r\n')
+        for name, path in files:
+            self.stats[path] = [os.path.getsize(path), None, None]
+            header = self._header(name, os.path.basename(path)) + 'Content-Type: application/octet-stream\r\n\r\n'
+            self.parts += [header.encode('utf-8'), path, b'\r\n']
+        self.parts.append('--{}--\r\n'.format(self.boundary).encode('utf-8'))
+        self.length = sum(len(p) if isinstance(p, bytes) else self.stats[p][0] for p in self.parts)
+        self._index = 0
+        self._offset = 0
+        self._file = None
+
+    def _header(self, name, filename=None):
+        disposition = 'form-data; name="{}"'.format(name)
+        if filename is not None:
+            disposition += '; filename="{}"'.format(filename.replace('"', '%22'))
+            return '--{}\r\nContent-Disposition: {}\r\n'.format(self.boundary, disposition)
+        return '--{}\r\nContent-Disposition: {}\r\n\r\n'.format(self.boundary, disposition)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def _read_file(self, path, size):
+        if self._file is None:
+            self._file = open(path, 'rb')
+            self.stats[path][1] = time.time()
+        data = self._file.read(size)
+        if not data:
+            self._file.close()
+            self._file = None
+            self.stats[path][2] = time.time()
+        return data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.chunk_size
+        while self._index < len(self.parts):
+            part = self.parts[self._index]
+            if isinstance(part, bytes):
+                data = part[self._offset:self._offset + size]
+                self._offset += len(data)
+                if self._offset >= len(part):
+                    self._index += 1
+                    self._offset = 0
+                if data:
+                    return data
+                continue
+            data = self._read_file(part, size)
+            if data:
+                return data
+            self._index += 1
+        return b''
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def upload_stream(kae, appname, filetype, paths):
+    """upload paths in one streamed request, return (console response, stats of MultipartStream)"""
+    with MultipartStream([('fileType', filetype)], [('file', p) for p in paths]) as stream:
+        res = kae.request('spark/%s/upload' % appname, method='POST', data=stream,
+                          headers={'Content-Type': stream.content_type})
+    return res, stream.stats
+
+
+def _split_requests(paths):
+    """one request for the small files of a group, one for every large file"""
+    small = [p for p in paths if os.path.getsize(p) < LARGE_FILE_SIZE]
+    requests = [[p] for p in paths if p not in small]
+    if small:
+        requests.insert(0, small)
+    return requests
+
+
+def echo_file_stats(filetype, stats):
+    for path, (size, start, end) in stats.items():
+        elapsed = max((end or time.time()) - (start or time.time()), 1e-6)
+        click.echo('{} {}: {} in {:.1f}s ({}/s)'.format(
+            filetype, os.path.basename(path), format_size(size), elapsed, format_size(size / elapsed)))
+
+
+def upload_files(kae, appname, groups, concurrency=DEFAULT_UPLOAD_CONCURRENCY, manifest=None):
+    """upload {filetype: [path]} concurrently, return {filetype: [remote path]}
+    in the same order as the local paths. files found in manifest(an
+    UploadManifest) aren't uploaded again. raise KaeAPIError or the error
+    returned by console of the first failed request."""
+    from kaelib import KaeAPIError
+
+    # {(filetype, local path): remote path}
+    uploaded = {}
+    tasks = []
+    for filetype, paths in groups.items():
+        pending = []
+        for p in paths:
+            remote = manifest.lookup(filetype, p) if manifest else None
+            if remote:
+                uploaded[(filetype, p)] = remote
+                click.echo('{} {}: unchanged, reuse {}'.format(filetype, os.path.basename(p), remote))
+            elif p not in pending:
+                pending.append(p)
+        for chunk in _split_requests(pending):
+            tasks.append((filetype, chunk))
+
+    local = threading.local()
+    lock = threading.Lock()
+
+    def run(task):
+        filetype, chunk = task
+        if not hasattr(local, 'api'):
+            local.api = clone_kae_api(kae, kae.cluster)
+        res, stats = upload_stream(local.api, appname, filetype, chunk)
+        if res.get('error'):
+            raise KaeAPIError(400, res['error'])
+        with lock:
+            echo_file_stats(filetype, stats)
+        path = res['data']['path']
+        return path if isinstance(path, list) else [path]
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(min(concurrency, len(tasks)), 1)) as executor:
+            futures = [(task, executor.submit(run, task)) for task in tasks]
+            for (filetype, chunk), future in futures:
+                for p, remote in zip(chunk, future.result()):
+                    uploaded[(filetype, p)] = remote
+                    if manifest:
+                        manifest.record(filetype, p, remote)
+    finally:
+        if manifest:
+            manifest.save()
+    return {filetype: [uploaded[(filetype, p)] for p in paths] for filetype, paths in groups.items()}
@@ -7,23 +7,19 @@
 from __future__ import print_function, division, absolute_import
 import sys
 import os
-import re
 import errno
+import time
 from os import getenv
+from os.path import expanduser
 from contextlib import contextmanager
 from urllib.parse import urlparse
 
-from keycloak import KeycloakOpenID
 import click
-import delegator
 import json
 import yaml
 from click import ClickException
-from reprint import output
-from prettytable import PrettyTable
-from kaelib import KaeAPIError
 
-_GITLAB_CI_REMOTE_URL_PATTERN = re.compile(r'http://gitlab-ci-token:(.+)@([\.\w]+)/([-\w]+)/([-/\w]+).git')
+from kae.git import GitError, get_git_repo_info
 
 
 def warn(text):
@@ -51,6 +47,22 @@ def fatal(msg):
     sys.exit(1)
 
 
+def load_yaml(stream):
+    """yaml.safe_load, but use the libyaml C loader when it's available"""
+    return yaml.load(stream, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+
+def get_cache_dir(*parts):
+    """local cache dir, `cache` next to config.yaml by default,
+    set KAE_CACHE_DIR to put it somewhere else, e.g. the cache dir of CI"""
+    cache_dir = getenv('KAE_CACHE_DIR')
+    if not cache_dir:
+        ctx = click.get_current_context(silent=True)
+        config_path = ctx.obj.get('config_path') if ctx and ctx.obj else None
+        cache_dir = os.path.join(os.path.dirname(config_path or expanduser('~/.kae/config.yaml')), 'cache')
+    return os.path.join(cache_dir, *parts)
+
+
 def mkdir_p(path):
     try:
         os.makedirs(path)
@@ -61,35 +73,36 @@ def mkdir_p(path):
             raise
 
 
+def format_console_err(e):
+    """error message of a KaeAPIError"""
+    if e.http_code == 404:
+        return "resource not found: {}".format(str(e))
+    elif 400 <= e.http_code <= 409:
+        return e.msg
+    else:
+        return "Internel Error: {}".format(e.msg)
+
+
 @contextmanager
 def handle_console_err():
+    from kaelib import KaeAPIError
+
     try:
         yield
     except KaeAPIError as e:
-        if e.http_code == 404:
-            fatal("resource not found: {}".format(str(e)))
-        elif 400 <= e.http_code <= 409:
-            fatal(e.msg)
-        else:
-            fatal("Internel Error: {}".format(e.msg))
+        fatal(format_console_err(e))
 
 
 def get_current_branch(cwd=None):
-    """inside gitlab-ci, repo is at detached state, so you cannot get branch
-    name from the current git repo, but luckily there's a environment
-    variable called CI_BUILD_REF_NAME"""
     ctx = click.get_current_context()
-    r = delegator.run('git rev-parse --abbrev-ref HEAD', cwd=cwd)
-    if r.return_code:
+    try:
+        branch = get_git_repo_info(cwd).branch
+    except GitError as e:
         if ctx.obj['debug']:
-            click.echo(debug_log('get_current_branch error: (stdout)%s, (stderr)%s', r.out, r.err))
+            click.echo(debug_log('get_current_branch error: %s', str(e)))
 
         return ''
 
-    branch = r.out.strip()
-    if branch == 'HEAD':
-        branch = getenv('CI_BUILD_REF_NAME', '')
-
     if ctx.obj['debug']:
         click.echo(debug_log('get_branch: %s', branch))
 
@@ -100,11 +113,11 @@ def get_commit_hash(cwd=None):
     """拿cwd的最新的commit hash."""
     ctx = click.get_current_context()
 
-    r = delegator.run('git rev-parse HEAD', cwd=cwd)
-    if r.return_code:
-        raise ClickException(r.err)
+    try:
+        commit_hash = get_git_repo_info(cwd).commit_hash
+    except GitError as e:
+        raise ClickException(str(e))
 
-    commit_hash = r.out.strip()
     if ctx.obj['debug']:
         click.echo(debug_log('get_commit_hash: %s', commit_hash))
     return commit_hash
@@ -115,15 +128,15 @@ def get_git_tag(cwd=None, git_tag=None, required=True):
         return git_tag
     ctx = click.get_current_context()
 
-    r = delegator.run('git describe --exact-match --abbrev=0 --tags', cwd=cwd)
-    if r.return_code:
+    try:
+        git_tag = get_git_repo_info(cwd).tag
+    except GitError as e:
         if required is True:
-            fatal(r.err)
+            fatal(str(e))
         else:
-            click.echo(warn(r.err))
+            click.echo(warn(str(e)))
             return None
 
-    git_tag = r.out.strip()
     if ctx.obj['debug']:
         click.echo(debug_log('get_git_tag: %s', git_tag))
     if (not git_tag) and (required is True):
@@ -132,25 +145,13 @@ def get_git_tag(cwd=None, git_tag=None, required=True):
 
 
 def get_remote_url(cwd=None, remote='origin'):
-    """拿cwd的remote的url.
-    发现envoy.run的command只能是bytes, 不能是unicode.
-    """
+    """拿cwd的remote的url."""
     ctx = click.get_current_context()
 
-    r = delegator.run('git remote get-url %s' % str(remote), cwd=cwd)
-    if r.return_code:
-        raise ClickException(r.err)
-
-    remote = r.out.strip()
-
-    # 对gitlab ci需要特殊处理一下
-    # 丫有个特殊的格式, 不太好支持...
-    match = _GITLAB_CI_REMOTE_URL_PATTERN.match(remote)
-    if match:
-        host = match.group(2)
-        group = match.group(3)
-        project = match.group(4)
-        return 'git@{host}:{group}/{project}.git'.format(host=host, group=group, project=project)
+    try:
+        remote = get_git_repo_info(cwd).remote_url(remote)
+    except GitError as e:
+        raise ClickException(str(e))
 
     if ctx.obj['debug']:
         click.echo(debug_log('get_remote_url: %s', remote))
@@ -160,14 +161,16 @@ def get_remote_url(cwd=None, remote='origin'):
 def get_appname(cwd=None, appname=None, required=True):
     if appname:
         return appname
+    from kae.spec import load_app_spec, SpecError
+
     try:
-        with open(os.path.join(cwd or os.getcwd(), 'app.yaml'), 'r') as f:
-            specs = yaml.safe_load(f)
+        appname = load_app_spec(os.path.join(cwd or os.getcwd(), 'app.yaml')).appname
     except IOError:
         if required:
             fatal('appname not specified, check app.yaml or pass argument to it.')
         return ''
-    appname = specs.get('appname', '')
+    except SpecError as e:
+        fatal(str(e))
 
     if (required is True) and (not appname):
         fatal('appname not specified, check app.yaml or pass argument to it.')
@@ -182,10 +185,27 @@ def read_json_file(path):
         return None
 
 
+def write_json_file(data, path, mode=0o644):
+    """write atomically, readers never see a half written file"""
+    mkdir_p(os.path.dirname(path))
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return '{:.1f}{}'.format(size, unit) if unit != 'B' else '{}B'.format(size)
+        size /= 1024.0
+
+
 def read_yaml_file(path):
     try:
         with open(path) as f:
-            return yaml.safe_load(f)
+            return load_yaml(f)
     except (OSError, IOError):
         return None
 
@@ -200,9 +220,10 @@ def write_yaml_file(data, path):
 
 
 def get_specs_text_from_repo(cwd=None):
+    from kae.spec import load_app_spec
+
     try:
-        with open(os.path.join(cwd or os.getcwd(), 'app.yaml'), 'r') as f:
-            return f.read()
+        return load_app_spec(os.path.join(cwd or os.getcwd(), 'app.yaml')).specs_text
     except IOError:
         return None
 
@@ -211,9 +232,10 @@ def get_specs_text(fname, literal):
     if literal:
         specs_text = literal
     elif fname:
+        from kae.spec import load_app_spec
+
         try:
-            with open(fname, "r") as fp:
-                specs_text = fp.read()
+            specs_text = load_app_spec(fname).specs_text
         except:
             fatal("can't read specs text from {}".format(fname))
     else:
@@ -233,71 +255,30 @@ def merge_list(l1, l2):
         l1[len2:] = ["" for i in range(len1 - len2)]
 
 
-def display_pods(kae, watcher, appname, canary=False, forever=False):
-    def get_replicas(appname):
-        with handle_console_err():
-            dp = kae.get_app_deployment(appname, canary)
-            return dp['spec']['replicas']
-
-    def extract_data_from_pod(pod):
-        status = pod['status']['phase']
-        restart_count = 0
-        ready_count = 0
-        ready_total = len(pod['spec']['containers'])
-        c_status_list = pod['status'].get('container_statuses', None)
-        if c_status_list:
-            for cont_status in c_status_list:
-                if cont_status['ready']:
-                    ready_count += 1
-                else:
-                    if cont_status['state'].get('terminated', None):
-                        status = cont_status['state']['terminated']['reason']
-                    elif cont_status['state'].get('waiting', None):
-                        status = cont_status['state']['waiting']['reason']
-            if cont_status['restart_count'] > restart_count:
-                restart_count = cont_status['restart_count']
-        return {
-            'ready_count': ready_count,
-            'ready_total': ready_total,
-            "ready": "{}/{}".format(ready_count, ready_total),
-            "name": pod['metadata']['name'],
-            'status': status,
-            'restarts': restart_count,
-            'ip': pod['status'].get('pod_ip', None),
-            'node': pod['status'].get('host_ip', None),
-        }
-
-    def print_table(pod_map, output_list):
-        ready_pods = 0
-        table = PrettyTable(['name', 'status', 'ready', 'restarts', 'ip', 'node'])
-        for name, pod in pod_map.items():
-            data = extract_data_from_pod(pod)
-            table.add_row([name, data['status'], data['ready'], data['restarts'], data['ip'], data['node']])
-            if data['ready_count'] == data['ready_total']:
-                ready_pods += 1
-        merge_list(output_list, str(table).split('\n'))
-        return ready_pods
-
-    pod_map = {}
-    replicas = get_replicas(appname)
-
-    with output(output_type="list", initial_len=10, interval=0) as output_list:
-        ready_pods = print_table(pod_map, output_list)
-        if ready_pods == replicas and ready_pods == len(pod_map):
-            return
-
-        for m in watcher:
-            action = m['action']
-            pod = m["object"]
-            name = pod['metadata']['name']
-            if action == 'DELETED':
-                pod_map.pop(name, None)
-            else:
-                pod_map[name] = pod
-            # display table
-            ready_pods = print_table(pod_map, output_list)
-            if forever is False and ready_pods == replicas and ready_pods == len(pod_map):
-                return
+def get_clusters(ctx, cluster, all_clusters=False):
+    """`--cluster a,b,c` or `--all-clusters`, which uses `clusters` in config.yaml"""
+    if all_clusters:
+        clusters = (ctx.obj.get('config') or {}).get('clusters') or []
+        if not clusters:
+            fatal('no clusters found, please add a `clusters` list to {}'.format(ctx.obj['config_path']))
+        return list(clusters)
+    clusters = [c.strip() for c in cluster.split(',') if c.strip()]
+    if not clusters:
+        fatal('cluster name is required')
+    return clusters
+
+
+def clone_kae_api(kae, cluster):
+    """a new KaeAPI for cluster sharing the credential of kae, so threads
+    don't race on kae.set_cluster"""
+    from kaelib import KaeAPI
+
+    api = KaeAPI(kae.host, version=kae.version, timeout=kae.timeout, cluster=cluster)
+    api.session.headers.update(kae.session.headers)
+    cache = getattr(kae, 'response_cache', None)
+    if cache is not None:
+        cache.install(api)
+    return api
 
 
 def abort_if_false(ctx, param, value):
@@ -305,7 +286,51 @@ def abort_if_false(ctx, param, value):
         ctx.abort()
 
 
-def get_sso_token(user, password, sso_host="localhost", realm="kae", client_id="kae-cli", totp=None):
+# refresh a little before the server side expiry to absorb clock skew and
+# the latency of the request that is about to use the token
+_TOKEN_EXPIRY_MARGIN = 30
+
+
+def get_token_cache_path(config_path):
+    """token cache lives next to config.yaml"""
+    return os.path.join(os.path.dirname(config_path), 'token.json')
+
+
+def get_token_cache_key(user, sso_host, realm, client_id):
+    return '{}|{}|{}|{}'.format(sso_host, realm, client_id, user)
+
+
+def read_token_cache(path):
+    """{} when the cache is missing or corrupt(e.g. truncated), the user
+    just logs in again"""
+    try:
+        cache = read_json_file(path)
+    except ValueError:
+        cache = None
+    if not isinstance(cache, dict):
+        return {}
+    return cache
+
+
+def write_token_cache(cache, path):
+    """write the cache atomically and readable only by the current user"""
+    write_json_file(cache, path, mode=0o600)
+
+
+def _make_token_entry(token_info, now):
+    refresh_expires_in = token_info.get('refresh_expires_in', 0)
+    return {
+        'access_token': token_info['access_token'],
+        'expires_at': now + token_info.get('expires_in', 0) - _TOKEN_EXPIRY_MARGIN,
+        'refresh_token': token_info.get('refresh_token'),
+        # keycloak uses 0 for refresh tokens without expiry(offline tokens)
+        'refresh_expires_at': (now + refresh_expires_in - _TOKEN_EXPIRY_MARGIN) if refresh_expires_in else None,
+    }
+
+
+def get_keycloak_client(sso_host, realm, client_id):
+    from keycloak import KeycloakOpenID
+
     o = urlparse(sso_host)
     if not o.scheme:
         # url is a host
@@ -314,13 +339,70 @@ def get_sso_token(user, password, sso_host="localhost", realm="kae", client_id="
         url = sso_host
 
     # Configure client
-    keycloak_openid = KeycloakOpenID(server_url=url,
-                        client_id=client_id,
-                        realm_name=realm,
-                        # client_secret_key="secret",
-                        verify=True)
-
-    # Get Token
-    tokenInfo = keycloak_openid.token(user, password, totp=totp)
-    # token = keycloak_openid.token("user", "password", totp="012345")
-    return tokenInfo.get('access_token')
+    return KeycloakOpenID(server_url=url,
+                          client_id=client_id,
+                          realm_name=realm,
+                          # client_secret_key="secret",
+                          verify=True)
+
+
+def get_sso_token(user, password, sso_host="localhost", realm="kae", client_id="kae-cli", totp=None, cache_path=None):
+    """return an access token, try in order:
+    1. the valid access token in token cache
+    2. refresh token in token cache
+    3. password grant
+    pass cache_path=None to disable the token cache.
+    """
+    entry = get_sso_token_entry(user, password, sso_host, realm, client_id, totp=totp, cache_path=cache_path)
+    return entry['access_token']
+
+
+def get_sso_token_entry(user, password, sso_host="localhost", realm="kae", client_id="kae-cli",
+                        totp=None, cache_path=None, entry=None):
+    """like get_sso_token, but return the whole token cache entry, which
+    contains the expiry time. when cache_path is None, the previous `entry`
+    is used in place of the token cache"""
+    from keycloak.exceptions import KeycloakError
+
+    ctx = click.get_current_context(silent=True)
+    debug = bool(ctx and ctx.obj and ctx.obj.get('debug'))
+    start = time.time()
+
+    key = get_token_cache_key(user, sso_host, realm, client_id)
+    cache = read_token_cache(cache_path) if cache_path else {}
+    if cache_path:
+        entry = cache.get(key)
+    if entry and entry.get('expires_at', 0) > start:
+        if debug:
+            click.echo(debug_log('get_sso_token: cached access token, %.1fms', (time.time() - start) * 1000))
+        return entry
+
+    keycloak_openid = get_keycloak_client(sso_host, realm, client_id)
+
+    token_info = None
+    source = 'password grant'
+    refresh_expires_at = (entry or {}).get('refresh_expires_at')
+    if entry and entry.get('refresh_token') and (refresh_expires_at is None or refresh_expires_at > start):
+        try:
+            token_info = keycloak_openid.refresh_token(entry['refresh_token'])
+            source = 'refresh token'
+        except KeycloakError as e:
+            # the session may be revoked on server side, fall back to password grant
+            if debug:
+                click.echo(debug_log('get_sso_token: refresh token rejected: %s', str(e)))
+
+    if token_info is None:
+        # Get Token
+        token_info = keycloak_openid.token(user, password, totp=totp)
+
+    entry = _make_token_entry(token_info, start)
+    if cache_path:
+        cache[key] = entry
+        try:
+            write_token_cache(cache, cache_path)
+        except (OSError, IOError) as e:
+            click.echo(warn("can't write token cache {}: {}".format(cache_path, str(e))))
+
+    if debug:
+        click.echo(debug_log('get_sso_token: %s, %.1fms', source, (time.time() - start) * 1000))
+    return entry